@@ -0,0 +1,44 @@
+import time
+
+from persistence import AppendLog
+
+
+class ActivityStore:
+    """Время последней активности пользователей (секунды Unix).
+
+    В журнал пишется не каждое действие, а не чаще раза в resolution
+    секунд на пользователя; при загрузке журнал сжимается до последней
+    записи на пользователя, если сильно разросся.
+    log - путь к файлу журнала или объект с интерфейсом AppendLog.
+    """
+
+    def __init__(self, log, resolution=3600):
+        self.log = AppendLog(log) if isinstance(log, str) else log
+        self.resolution = resolution
+        self._last_active = {}
+        self._records = 0
+
+    def load(self):
+        self._last_active = {}
+        self._records = 0
+        for record in self.log.replay():
+            self._last_active[record['user']] = max(record['t'], self._last_active.get(record['user'], 0))
+            self._records += 1
+        if self._records > 2 * len(self._last_active):
+            self.log.rewrite({'user': user_id, 't': t} for user_id, t in self._last_active.items())
+            self._records = len(self._last_active)
+
+    def touch(self, user_id, now=None):
+        now = int(now if now is not None else time.time())
+        last = self._last_active.get(user_id)
+        if last is not None and now - last < self.resolution:
+            return
+        self._last_active[user_id] = now
+        self.log.append({'user': user_id, 't': now})
+        self._records += 1
+
+    def last_active(self, user_id):
+        return self._last_active.get(user_id)
+
+    def close(self):
+        self.log.close()
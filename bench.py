@@ -0,0 +1,369 @@
+"""Бенчмарк обработчиков main.py на синтетических данных.
+
+Для каждого размера генерируется детерминированная база пользователей
+(пол, возраст и предпочтения, граф лайков со степенным распределением
+популярности, отзывы), после чего настоящие обработчики вызываются
+через заглушки Update/Context и фейковый бот без сети. Каждый размер
+прогоняется в отдельном процессе со своим каталогом данных.
+
+    python bench.py                       # 1000, 10000 и 100000 пользователей
+    python bench.py --users 5000 --iterations 2000 --storage sqlite
+
+Выводятся p50/p95/p99 (мс) по каждому обработчику и объём прочитанных
+и записанных хранилищем данных. Для SQLite он берётся из счётчиков
+ввода-вывода процесса (/proc/self/io) за время загрузки и прогона;
+где их нет, выводится n/a.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from metrics import percentile
+
+GENDERS = (('Мужской', 48), ('Женский', 48), ('Другой', 4))
+ABOUT_WORDS = ('музыка', 'кино', 'спорт', 'книги', 'путешествия', 'кофе', 'игры', 'горы', 'море', 'готовка')
+REVIEW_TEXTS = ('Приятно пообщаться', 'Интересный человек', 'Отвечает быстро', 'Хороший собеседник', 'Весёлый')
+
+
+# --- Синтетические данные ---
+
+def generate_profiles(rng, count):
+    genders = [gender for gender, _ in GENDERS]
+    weights = [weight for _, weight in GENDERS]
+    profiles = []
+    for user_id in range(1, count + 1):
+        gender = rng.choices(genders, weights)[0]
+        age = max(18, min(70, int(rng.triangular(18, 60, 24))))
+        if gender == 'Другой' or rng.random() < 0.1:
+            target_gender = 'Любой'
+        else:
+            target_gender = 'Женский' if gender == 'Мужской' else 'Мужской'
+        spread = rng.randint(3, 10)
+        profile = {
+            'user_id': user_id,
+            'username': f'user{user_id}',
+            'gender': gender,
+            'age': age,
+            'about': ' '.join(rng.sample(ABOUT_WORDS, 3)),
+            'target_gender': target_gender,
+            'age_min': max(13, age - spread),
+            'age_max': min(120, age + spread),
+            'photo_id': f'photo-{user_id}' if rng.random() < 0.7 else None,
+        }
+        profiles.append(profile)
+    return profiles
+
+
+def generate_likes(rng, count, mean_likes=10, exponent=1.1):
+    """Лайки со степенным распределением: немногие анкеты получают большую часть"""
+    ranked = list(range(1, count + 1))
+    rng.shuffle(ranked)
+    cum_weights = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+    for user_id in range(1, count + 1):
+        k = min(count - 1, int(rng.expovariate(1 / mean_likes)))
+        targets = set(rng.choices(ranked, cum_weights=cum_weights, k=k))
+        targets.discard(user_id)
+        for target in targets:
+            yield {'from': user_id, 'to': target}
+
+
+def generate_reviews(rng, count, share=0.2):
+    reviews = {}
+    for user_id in rng.sample(range(1, count + 1), int(count * share)):
+        reviews[f'user{user_id}'] = [rng.choice(REVIEW_TEXTS) for _ in range(rng.randint(1, 5))]
+    return reviews
+
+
+def write_dataset(data_dir, count, seed):
+    rng = random.Random(seed)
+    with open(os.path.join(data_dir, 'users.json'), 'w', encoding='utf-8') as f:
+        json.dump(generate_profiles(rng, count), f, ensure_ascii=False)
+    with open(os.path.join(data_dir, 'likes.log'), 'w', encoding='utf-8') as f:
+        for record in generate_likes(rng, count):
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+    with open(os.path.join(data_dir, 'reviews.json'), 'w', encoding='utf-8') as f:
+        json.dump(generate_reviews(rng, count), f, ensure_ascii=False)
+
+
+# --- Заглушки Telegram ---
+
+class FakePhotoSize:
+    def __init__(self, file_id):
+        self.file_id = file_id
+        self.file_unique_id = 'u-' + file_id
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, bot, chat_id, text=None, photo=None, from_user=None, reply_markup=None):
+        self._bot = bot
+        self.message_id = next(self._ids)
+        self.chat_id = chat_id
+        self.text = text
+        self.photo = photo
+        self.from_user = from_user
+        self.reply_markup = reply_markup
+
+    def get_bot(self):
+        return self._bot
+
+    async def reply_text(self, text, **kwargs):
+        return await self._bot.send_message(self.chat_id, text, **kwargs)
+
+    async def reply_photo(self, photo, caption=None, **kwargs):
+        return await self._bot.send_photo(self.chat_id, photo, caption=caption, **kwargs)
+
+    async def edit_text(self, text, **kwargs):
+        self._bot.calls += 1
+        self.text = text
+        return self
+
+    async def edit_caption(self, caption=None, **kwargs):
+        self._bot.calls += 1
+        return self
+
+    async def edit_media(self, media, **kwargs):
+        self._bot.calls += 1
+        self.photo = [FakePhotoSize(media.media)]
+        return self
+
+    async def delete(self):
+        self._bot.calls += 1
+        return True
+
+
+class FakeBot:
+    """Бот без сети: запоминает число вызовов и последнее сообщение"""
+
+    def __init__(self):
+        self.calls = 0
+        self.last_message = None
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.calls += 1
+        self.last_message = FakeMessage(self, chat_id, text=text, reply_markup=reply_markup)
+        return self.last_message
+
+    async def send_photo(self, chat_id, photo, caption=None, reply_markup=None, **kwargs):
+        self.calls += 1
+        self.last_message = FakeMessage(
+            self, chat_id, text=caption, photo=[FakePhotoSize(photo)], reply_markup=reply_markup
+        )
+        return self.last_message
+
+
+def shown_candidate(message):
+    """user_id анкеты на карточке или None, если это не карточка"""
+    keyboard = getattr(message and message.reply_markup, 'inline_keyboard', None)
+    if not keyboard:
+        return None
+    return int(keyboard[0][0].callback_data.split('_')[1])
+
+
+class FakeCallbackQuery:
+    def __init__(self, data, from_user, message):
+        self.data = data
+        self.from_user = from_user
+        self.message = message
+
+    async def answer(self, text=None, show_alert=False):
+        self.message.get_bot().calls += 1
+
+
+def fake_user(user_id):
+    return SimpleNamespace(id=user_id, username=f'user{user_id}', first_name='Имя', last_name=None)
+
+
+def message_update(bot, user_id, text=None):
+    user = fake_user(user_id)
+    message = FakeMessage(bot, user_id, text=text, from_user=user)
+    return SimpleNamespace(
+        message=message, callback_query=None,
+        effective_user=user, effective_chat=SimpleNamespace(id=user_id),
+    )
+
+
+def callback_update(bot, user_id, data, card_message):
+    user = fake_user(user_id)
+    return SimpleNamespace(
+        message=None, callback_query=FakeCallbackQuery(data, user, card_message),
+        effective_user=user, effective_chat=SimpleNamespace(id=user_id),
+    )
+
+
+# --- Прогон в дочернем процессе ---
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50), 'p95': percentile(values, 95), 'p99': percentile(values, 99),
+    }
+
+
+async def run_workload(main, count, iterations, seed):
+    rng = random.Random(seed + 1)
+    bot = FakeBot()
+    await main.start_storage(SimpleNamespace(bot=bot))
+    timings = {}
+
+    async def measure(name, coroutine):
+        started = time.perf_counter()
+        result = await coroutine
+        timings.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+        return result
+
+    contexts = {}
+    for _ in range(iterations):
+        user_id = rng.randint(1, count)
+        context = contexts.setdefault(user_id, SimpleNamespace(user_data={}, bot=bot))
+
+        bot.last_message = None
+        await measure('search', main.search(message_update(bot, user_id, "Искать собеседника"), context))
+        candidate_id = shown_candidate(bot.last_message)
+        if candidate_id is not None:
+            card = FakeMessage(bot, user_id, photo=None)
+            action = 'like' if rng.random() < 0.5 else 'skip'
+            update = callback_update(bot, user_id, f'{action}_{candidate_id}', card)
+            await measure(f'button_handler:{action}', main.button_handler(update, context))
+
+        profile = main.find_user_by_id(rng.randint(1, count))
+        await measure('show_profile', main.show_profile(message_update(bot, user_id), context, profile))
+
+        other_id = rng.randint(1, count)
+        started = time.perf_counter()
+        main.add_like(user_id, other_id)
+        timings.setdefault('add_like', []).append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        main.check_mutual_like(user_id, other_id)
+        timings.setdefault('check_mutual_like', []).append((time.perf_counter() - started) * 1000)
+
+        context.user_data['review_target'] = f'@user{rng.randint(1, count)}'
+        update = message_update(bot, user_id, rng.choice(REVIEW_TEXTS))
+        await measure('review_enter_text', main.review_enter_text(update, context))
+
+    await main.stop_outbox(None)
+    await main.stop_storage(None)
+    return timings, bot.calls
+
+
+def process_io():
+    """(прочитано, записано) байт процессом через read/write, или None"""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+    except OSError:
+        return None
+    return int(fields['rchar']), int(fields['wchar'])
+
+
+def run_child(count, iterations, seed, storage):
+    data_dir = os.environ['BOT_DATA_DIR']
+    started = time.perf_counter()
+    write_dataset(data_dir, count, seed)
+    if storage == 'sqlite':
+        import migrate
+        migrate.migrate(data_dir, os.path.join(data_dir, 'bot.db'))
+    generate_seconds = time.perf_counter() - started
+
+    import main
+    import metrics
+    io_before = process_io()
+    started = time.perf_counter()
+    main.init_storage()
+    load_seconds = time.perf_counter() - started
+
+    timings, api_calls = asyncio.run(run_workload(main, count, iterations, seed))
+    io_after = process_io()
+    if storage == 'sqlite':
+        # SQLite читает и пишет страницы сам, мимо замеров persistence
+        if io_before is not None and io_after is not None:
+            bytes_read, bytes_written = (after - before for before, after in zip(io_before, io_after))
+        else:
+            bytes_read = bytes_written = None
+    else:
+        totals = metrics.totals()
+        bytes_read = int(totals.get('storage.bytes_read', (0, 0))[1])
+        bytes_written = int(totals.get('storage.bytes_write', (0, 0))[1])
+    result = {
+        'users': count,
+        'generate_s': round(generate_seconds, 2),
+        'load_s': round(load_seconds, 2),
+        'api_calls': api_calls,
+        'bytes_read': bytes_read,
+        'bytes_written': bytes_written,
+        'handlers': {name: percentiles(values) for name, values in sorted(timings.items())},
+    }
+    print(json.dumps(result))
+
+
+def run_size(count, iterations, seed, storage):
+    with tempfile.TemporaryDirectory(prefix=f'bench-{count}-') as data_dir:
+        env = dict(
+            os.environ,
+            BOT_DATA_DIR=data_dir,
+            BOT_STORAGE=storage,
+            BOT_METRICS='1',
+            BOT_METRICS_LOG_INTERVAL='0',
+            BOT_OUTBOX_RATE='1000000',
+            BOT_OUTBOX_CHAT_INTERVAL='0',
+        )
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', str(count),
+             '--iterations', str(iterations), '--seed', str(seed), '--storage', storage],
+            env=env, check=True, stdout=subprocess.PIPE, text=True,
+        ).stdout
+        # Последняя строка - результат, выше может быть вывод модулей
+        return json.loads(output.strip().splitlines()[-1])
+
+
+def format_bytes(value):
+    return 'n/a' if value is None else f'{value} Б'
+
+
+def report(result):
+    print(
+        f"\n=== {result['users']} пользователей: генерация {result['generate_s']} с, "
+        f"загрузка {result['load_s']} с, прочитано {format_bytes(result['bytes_read'])}, "
+        f"записано {format_bytes(result['bytes_written'])}, вызовов API {result['api_calls']}"
+    )
+    print(f"{'обработчик':<24}{'n':>8}{'p50, мс':>12}{'p95, мс':>12}{'p99, мс':>12}")
+    for name, stats in result['handlers'].items():
+        print(f"{name:<24}{stats['count']:>8}{stats['p50']:>12.3f}{stats['p95']:>12.3f}{stats['p99']:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк обработчиков бота")
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 100000], help="размеры базы")
+    parser.add_argument('--iterations', type=int, default=500, help="сценариев поиска на размер")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--json', action='store_true', help="вывести результаты в JSON")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.iterations, args.seed, args.storage)
+        return
+
+    results = [run_size(count, args.iterations, args.seed, args.storage) for count in args.users]
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for result in results:
+            report(result)
+
+
+if __name__ == "__main__":
+    main()
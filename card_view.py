@@ -0,0 +1,117 @@
+"""Показ карточек анкет в одном сообщении бота.
+
+Сообщение с фото нельзя превратить в текстовое и наоборот, поэтому
+переход выбирается по типу текущего сообщения: фото -> фото и
+текст -> текст редактируются на месте, остальные переходы заменяют
+сообщение новым. Нерабочие file_id запоминаются в PhotoRegistry и
+больше не отправляются.
+"""
+import logging
+from collections import OrderedDict
+from contextlib import suppress
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+# Признаки ошибки "фото по этому file_id недоступно" в ответе Telegram
+BAD_FILE_ERRORS = ('file identifier', 'file reference', 'type of file', 'wrong type', 'http url', 'photo_invalid')
+
+
+def _is_bad_file(error):
+    message = str(error).lower()
+    return any(marker in message for marker in BAD_FILE_ERRORS)
+
+
+def _not_modified(error):
+    return 'message is not modified' in str(error).lower()
+
+
+class PhotoRegistry:
+    """file_id фотографий анкет, которые Telegram больше не принимает.
+
+    Хранится не больше max_size последних нерабочих file_id (LRU, как
+    CardCache). Новая загрузка фото снимает с file_id отметку.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._invalid = OrderedDict()
+
+    def confirm(self, file_id):
+        """file_id только что пришёл от Telegram - он рабочий"""
+        self._invalid.pop(file_id, None)
+
+    def reject(self, file_id):
+        logger.warning(f"Фото {file_id} недоступно, карточка будет показываться без фото")
+        self._invalid[file_id] = None
+        self._invalid.move_to_end(file_id)
+        if len(self._invalid) > self.max_size:
+            self._invalid.popitem(last=False)
+
+    def usable(self, file_id):
+        """file_id, если его можно отправлять, иначе None"""
+        if not file_id or file_id in self._invalid:
+            return None
+        return file_id
+
+
+async def send_card(bot, chat_id, card, registry):
+    """Отправляет карточку новым сообщением"""
+    photo_id = registry.usable(card.photo_id)
+    if photo_id:
+        try:
+            message = await bot.send_photo(
+                chat_id=chat_id, photo=photo_id, caption=card.text, reply_markup=card.reply_markup
+            )
+            return message
+        except BadRequest as e:
+            if not _is_bad_file(e):
+                raise
+            registry.reject(photo_id)
+    return await bot.send_message(chat_id=chat_id, text=card.text, reply_markup=card.reply_markup)
+
+
+async def _replace(message, card, registry):
+    with suppress(BadRequest):
+        # Старое сообщение может быть уже удалено или слишком старым
+        await message.delete()
+    return await send_card(message.get_bot(), message.chat_id, card, registry)
+
+
+async def show_card(message, card, registry):
+    """Показывает карточку вместо сообщения бота message с прошлой карточкой"""
+    photo_id = registry.usable(card.photo_id)
+    try:
+        if photo_id and message.photo:
+            try:
+                result = await message.edit_media(
+                    InputMediaPhoto(photo_id, caption=card.text), reply_markup=card.reply_markup
+                )
+                return result
+            except BadRequest as e:
+                if not _is_bad_file(e):
+                    raise
+                registry.reject(photo_id)
+                return await _replace(message, card, registry)
+        if not photo_id and not message.photo:
+            return await message.edit_text(card.text, reply_markup=card.reply_markup)
+    except BadRequest as e:
+        if _not_modified(e):
+            return message
+        # Сообщение нельзя отредактировать (удалено или слишком старое)
+        logger.info(f"Карточка отправляется заново: {e}")
+    return await _replace(message, card, registry)
+
+
+async def show_notice(message, text):
+    """Заменяет карточку в message текстом без кнопок"""
+    try:
+        if message.photo:
+            return await message.edit_caption(caption=text, reply_markup=None)
+        return await message.edit_text(text, reply_markup=None)
+    except BadRequest as e:
+        if _not_modified(e):
+            return message
+        return await message.get_bot().send_message(chat_id=message.chat_id, text=text)
@@ -0,0 +1,60 @@
+from collections import OrderedDict, namedtuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Готовая карточка анкеты: подпись, фото (или None) и клавиатура
+Card = namedtuple('Card', ['text', 'photo_id', 'reply_markup'])
+
+
+def render_card(profile, top_reviews, more_reviews):
+    user_id = profile['user_id']
+
+    # Формируем текст анкеты
+    text = (
+        f"👤 {profile.get('name_age', 'Пользователь')}\n"
+        f"Пол: {profile['gender']}\n"
+        f"Возраст: {profile['age']}\n"
+        f"О себе: {profile['about']}\n"
+    )
+
+    # Добавляем отзывы, если они есть
+    if top_reviews:
+        lines = [f"{i}. {review}\n" for i, review in enumerate(top_reviews, 1)]
+        text += "📝 Отзывы:\n" + "".join(lines)
+        if more_reviews:
+            text += f"... и ещё {more_reviews} отзывов\n"
+    else:
+        text += "Отзывов пока нет\n"
+
+    # callback_data содержит user_id анкеты, поэтому клавиатура тоже кэшируется
+    keyboard = [
+        [
+            InlineKeyboardButton("👍 Нравится", callback_data=f"like_{user_id}"),
+            InlineKeyboardButton("➡️ Пропустить", callback_data=f"skip_{user_id}")
+        ]
+    ]
+    return Card(text, profile.get('photo_id'), InlineKeyboardMarkup(keyboard))
+
+
+class CardCache:
+    """LRU-кэш готовых карточек по user_id и версии анкеты"""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._cards = OrderedDict()
+
+    def get(self, user_id, version):
+        entry = self._cards.get(user_id)
+        if entry is None or entry[0] != version:
+            return None
+        self._cards.move_to_end(user_id)
+        return entry[1]
+
+    def put(self, user_id, version, card):
+        self._cards[user_id] = (version, card)
+        self._cards.move_to_end(user_id)
+        if len(self._cards) > self.max_size:
+            self._cards.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self._cards.pop(user_id, None)
@@ -0,0 +1,106 @@
+import os
+
+# Настройки бота. Все значения можно переопределить переменными окружения.
+
+# Каталог, в котором лежат users.json, likes.json, reviews.json
+DATA_DIR = os.getenv('BOT_DATA_DIR', '.')
+
+# Интервал (в секундах) фоновой записи изменений на диск
+FLUSH_INTERVAL = float(os.getenv('BOT_FLUSH_INTERVAL', '5'))
+
+# Количество изменённых записей, после которого запись запускается досрочно
+FLUSH_THRESHOLD = int(os.getenv('BOT_FLUSH_THRESHOLD', '100'))
+
+# Взаимный поиск: показывать только тех, чьим предпочтениям подходит сам пользователь
+SEARCH_TWO_SIDED = os.getenv('BOT_SEARCH_TWO_SIDED', '1') == '1'
+
+# Сколько пропущенных анкет помнить для каждого пользователя
+SEEN_LIMIT = int(os.getenv('BOT_SEEN_LIMIT', '5000'))
+
+# Ранжирование кандидатов в поиске: веса признаков (близость возраста к
+# середине искомого диапазона, наличие фото, число отзывов, недавняя активность)
+RANK_AGE_WEIGHT = float(os.getenv('BOT_RANK_AGE_WEIGHT', '1.0'))
+RANK_PHOTO_WEIGHT = float(os.getenv('BOT_RANK_PHOTO_WEIGHT', '0.5'))
+RANK_REVIEWS_WEIGHT = float(os.getenv('BOT_RANK_REVIEWS_WEIGHT', '0.3'))
+RANK_RECENCY_WEIGHT = float(os.getenv('BOT_RANK_RECENCY_WEIGHT', '1.0'))
+# Через сколько часов бездействия балл за активность падает вдвое
+RANK_RECENCY_HALF_LIFE_HOURS = float(os.getenv('BOT_RANK_RECENCY_HALF_LIFE_HOURS', '72'))
+# Сколько лучших анкет отбирать за раз в очередь поиска
+RANK_QUEUE_SIZE = int(os.getenv('BOT_RANK_QUEUE_SIZE', '50'))
+# Сколько кандидатов оценивать при пополнении очереди самое большее (0 - всех):
+# ограничивает время поиска на больших базах
+RANK_MAX_SCORED = int(os.getenv('BOT_RANK_MAX_SCORED', '500'))
+# Очереди поиска из precompute.py старше стольких часов не используются
+RECOMMENDATIONS_MAX_AGE_HOURS = float(os.getenv('BOT_RECOMMENDATIONS_MAX_AGE_HOURS', '24'))
+# Время активности пишется на диск не чаще раза в столько секунд на пользователя
+ACTIVITY_RESOLUTION = int(os.getenv('BOT_ACTIVITY_RESOLUTION', '3600'))
+
+# Сколько готовых карточек анкет держать в кэше
+CARD_CACHE_SIZE = int(os.getenv('BOT_CARD_CACHE_SIZE', '10000'))
+
+# SQLite: размер кэша страниц (в КБ)
+SQLITE_CACHE_KB = int(os.getenv('BOT_SQLITE_CACHE_KB', '20000'))
+
+# Потоки для операций с диском и базой и максимум одновременно ожидающих операций
+STORAGE_WORKERS = int(os.getenv('BOT_STORAGE_WORKERS', '4'))
+STORAGE_MAX_PENDING = int(os.getenv('BOT_STORAGE_MAX_PENDING', '64'))
+
+# Где хранить анкеты, лайки и отзывы: 'json' (файлы в DATA_DIR) или 'sqlite' (bot.db)
+STORAGE_BACKEND = os.getenv('BOT_STORAGE', 'json')
+
+# Как часто (в секундах) сохранять состояния диалогов и user_data
+STATE_FLUSH_INTERVAL = float(os.getenv('BOT_STATE_FLUSH_INTERVAL', '10'))
+
+# --- Работа с Telegram ---
+
+# Токен бота от @BotFather; без него бот не запускается
+BOT_TOKEN = os.getenv('BOT_TOKEN', '')
+
+# Адрес Bot API, к которому дописывается токен (пусто - https://api.telegram.org/bot)
+API_BASE_URL = os.getenv('BOT_API_BASE_URL', '')
+
+# Сколько обновлений обрабатывать одновременно (1 - строго по одному)
+CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', '64'))
+
+# Пул HTTP-соединений для запросов бота и таймауты (в секундах)
+CONNECTION_POOL_SIZE = int(os.getenv('BOT_CONNECTION_POOL_SIZE', '128'))
+POOL_TIMEOUT = float(os.getenv('BOT_POOL_TIMEOUT', '5'))
+CONNECT_TIMEOUT = float(os.getenv('BOT_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.getenv('BOT_READ_TIMEOUT', '10'))
+WRITE_TIMEOUT = float(os.getenv('BOT_WRITE_TIMEOUT', '10'))
+
+# Long polling: сколько секунд getUpdates ждёт новых обновлений
+POLL_TIMEOUT = int(os.getenv('BOT_POLL_TIMEOUT', '30'))
+
+# Как получать обновления: 'polling' или 'webhook'
+MODE = os.getenv('BOT_MODE', 'polling')
+
+# Webhook: адрес и порт HTTP-сервера, путь, секретный токен
+# (заголовок X-Telegram-Bot-Api-Secret-Token) и внешний адрес для setWebhook.
+# Если WEBHOOK_URL пуст, setWebhook не вызывается
+WEBHOOK_LISTEN = os.getenv('BOT_WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('BOT_WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('BOT_WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('BOT_WEBHOOK_SECRET', '')
+WEBHOOK_URL = os.getenv('BOT_WEBHOOK_URL', '')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('BOT_WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Очередь исходящих сообщений: воркеры, общий лимит сообщений в секунду,
+# минимальный интервал между сообщениями в один чат и число повторов
+OUTBOX_WORKERS = int(os.getenv('BOT_OUTBOX_WORKERS', '8'))
+OUTBOX_RATE = float(os.getenv('BOT_OUTBOX_RATE', '25'))
+OUTBOX_CHAT_INTERVAL = float(os.getenv('BOT_OUTBOX_CHAT_INTERVAL', '1'))
+OUTBOX_MAX_RETRIES = int(os.getenv('BOT_OUTBOX_MAX_RETRIES', '5'))
+
+# Замеры времени обработчиков, хранилища и Bot API (1 - включены).
+# Сводка пишется в лог раз в METRICS_LOG_INTERVAL секунд и, если задан
+# METRICS_PORT, отдаётся по HTTP
+METRICS_ENABLED = os.getenv('BOT_METRICS', '0') == '1'
+METRICS_LOG_INTERVAL = float(os.getenv('BOT_METRICS_LOG_INTERVAL', '60'))
+METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', '0'))
+
+# Запись входящих обновлений для replay.py (пусто - не записывать).
+# Личные данные заменяются псевдонимами с ключом RECORD_KEY; тем же ключом
+# replay.py обезличивает копию данных
+RECORD_FILE = os.getenv('BOT_RECORD_FILE', '')
+RECORD_KEY = os.getenv('BOT_RECORD_KEY', '')
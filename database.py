@@ -1,14 +1,82 @@
 import sqlite3
 import os
 import json
+import threading
+from collections.abc import Mapping
 
-DATA_FILE = 'database'
+import config
+from persistence import run_blocking
 
-def create_connection(db_file='database.py'):
+DATA_FILE = os.path.join(config.DATA_DIR, 'database')
+
+# Файл базы пользователей (раньше по ошибке открывался 'database.py')
+DB_FILE = os.path.join(config.DATA_DIR, 'bot.db')
+
+# Настройки соединения: WAL позволяет читать во время записи,
+# synchronous=NORMAL в режиме WAL безопасен и заметно быстрее FULL
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    f'PRAGMA cache_size=-{config.SQLITE_CACHE_KB}',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA busy_timeout=5000',
+)
+
+
+class ConnectionManager:
+    """Долгоживущие соединения с SQLite: по одному на поток.
+
+    Соединение открывается при первом обращении из потока и дальше
+    переиспользуется вместе с кэшем подготовленных запросов.
+    """
+
+    def __init__(self, db_file, cached_statements=256):
+        self.db_file = db_file
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, cached_statements=self.cached_statements)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+        return conn
+
+    def execute(self, sql, params=()):
+        """Выполняет один запрос и сразу фиксирует изменения"""
+        conn = self.connection()
+        with conn:
+            return conn.execute(sql, params)
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(db_file=DB_FILE):
+    """Общий ConnectionManager для файла базы"""
+    with _managers_lock:
+        manager = _managers.get(db_file)
+        if manager is None:
+            manager = _managers[db_file] = ConnectionManager(db_file)
+        return manager
+
+
+async def run(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с базой в пуле потоков хранилища.
+
+    Пример: await database.run(database.add_user, user.id, user.username, ...)
+    """
+    return await run_blocking(func, *args, **kwargs)
+
+
+def create_connection(db_file=DB_FILE):
     """ подключение к бд SQLite"""
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
+        conn = get_manager(db_file).connection()
         return conn
     except sqlite3.Error as e:
         print(e)
@@ -28,6 +96,14 @@ def create_table(conn):
                 join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                text TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
         conn.commit()
     except sqlite3.Error as e:
         print(e)
@@ -37,59 +113,133 @@ conn = create_connection()
 if conn is not None:
     create_table(conn)
     print("подкл к бд успешно")
-    conn.close()
 else:
     print("Невозможно создать подкл к бд")
-    
+
 
 
 # Добавление пользователя
 def add_user(user_id, username, first_name, last_name):
-    conn = create_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name))
-            conn.commit()
-        except sqlite3.Error as e:
-            print(e)
-        finally:
-            conn.close()
+    try:
+        get_manager().execute('''
+            INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, username, first_name, last_name))
+    except sqlite3.Error as e:
+        print(e)
 
 # Получение пользователя по user_id
 def get_user(user_id):
-    conn = create_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-            user = cursor.fetchone()
-            return user
-        except sqlite3.Error as e:
-            print(e)
-        finally:
-            conn.close()
+    try:
+        cursor = get_manager().connection().execute(
+            "SELECT * FROM users WHERE user_id=?", (user_id,)
+        )
+        return cursor.fetchone()
+    except sqlite3.Error as e:
+        print(e)
     return None
 
 #сохранение сообщений
 def save_message_to_db(user_id, text):
-    conn = create_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "INSERT INTO messages (user_id, text) VALUES (?, ?)",
-            (user_id, text)
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    get_manager().execute(
+        "INSERT INTO messages (user_id, text) VALUES (?, ?)",
+        (user_id, text)
+    )
+
+# --- Данные users/pairs в виде JSON ---
+
+def _ensure_data_tables(conn):
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS pairs (
+                pair_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            )
+        ''')
+
+
+class ChangeTracker:
+    """Какие пользователи и пары изменились с последнего save_data"""
+
+    def __init__(self):
+        self.users = set()
+        self.pairs = set()
+        self.deleted_users = set()
+        self.deleted_pairs = set()
+
+    def user_changed(self, user_id):
+        self.users.add(user_id)
+        self.deleted_users.discard(user_id)
+
+    def user_deleted(self, user_id):
+        self.deleted_users.add(user_id)
+        self.users.discard(user_id)
+
+    def pair_changed(self, pair_id):
+        self.pairs.add(pair_id)
+        self.deleted_pairs.discard(pair_id)
+
+    def pair_deleted(self, pair_id):
+        self.deleted_pairs.add(pair_id)
+        self.pairs.discard(pair_id)
+
+    def __bool__(self):
+        return bool(self.users or self.pairs or self.deleted_users or self.deleted_pairs)
+
+    def clear(self):
+        self.users.clear()
+        self.pairs.clear()
+        self.deleted_users.clear()
+        self.deleted_pairs.clear()
+
+
+class LazyTable(Mapping):
+    """Таблица (ключ, JSON) как словарь: строка читается и разбирается
+    только при обращении к ключу, разобранные значения кэшируются"""
+
+    def __init__(self, manager, table, key_column):
+        self._manager = manager
+        self._select = f"SELECT data FROM {table} WHERE {key_column} = ?"
+        self._keys = f"SELECT {key_column} FROM {table}"
+        self._count = f"SELECT COUNT(*) FROM {table}"
+        self._cache = {}
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            return self._cache[key]
+        row = self._manager.connection().execute(self._select, (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = self._cache[key] = json.loads(row[0])
+        return value
+
+    def __iter__(self):
+        for row in self._manager.connection().execute(self._keys):
+            yield row[0]
+
+    def __len__(self):
+        return self._manager.connection().execute(self._count).fetchone()[0]
+
 
 #загружение файлов
-def load_data():
-        conn = sqlite3.connect(DATA_FILE)
+def load_data(lazy=False):
+        """Загружает users и pairs. При lazy=True JSON разбирается только
+        для тех записей, к которым обращаются"""
+        manager = get_manager(DATA_FILE)
+        conn = manager.connection()
+        _ensure_data_tables(conn)
+        if lazy:
+            return {
+                "users": LazyTable(manager, "users", "user_id"),
+                "pairs": LazyTable(manager, "pairs", "pair_id")
+            }
+
         cursor = conn.cursor()
         # Загружаем пользователей
         cursor.execute("SELECT user_id, data FROM users")
@@ -99,8 +249,6 @@ def load_data():
         cursor.execute("SELECT pair_id, data FROM pairs")
         pairs = {row[0]: json.loads(row[1]) for row in cursor.fetchall()}
     
-        conn.close()
-    
         return {
             "users": users,
             "pairs": pairs
@@ -108,30 +256,51 @@ def load_data():
     
 
 #сохранение данных
-def save_data(data):
-        #Сохранение всех данных в базу данных
-        conn = sqlite3.connect(DATA_FILE)
-        cursor = conn.cursor()
-    
-        # Очищаем таблицы перед сохранением
-        cursor.execute("DELETE FROM users")
-        cursor.execute("DELETE FROM pairs")
-        
-        # Сохраняем пользователей
-        for user_id, user_data in data["users"].items():
-            cursor.execute(
-                "INSERT INTO users (user_id, data) VALUES (?, ?)",
-                (user_id, json.dumps(user_data, ensure_ascii=False))
+def save_data(data, changes=None):
+        """Сохраняет users и pairs одной транзакцией.
+
+        Если передан ChangeTracker, записываются только изменённые и
+        удалённые записи, иначе - все записи из data (и удаляются
+        отсутствующие). Таблицы не очищаются, читатели видят либо старое,
+        либо новое состояние.
+        """
+        manager = get_manager(DATA_FILE)
+        conn = manager.connection()
+        _ensure_data_tables(conn)
+
+        users = data["users"]
+        pairs = data["pairs"]
+        if changes is None:
+            user_ids, pair_ids = list(users), list(pairs)
+        else:
+            user_ids = [user_id for user_id in changes.users if user_id in users]
+            pair_ids = [pair_id for pair_id in changes.pairs if pair_id in pairs]
+
+        with conn:
+            if changes is None:
+                # Полное сохранение: удаляем только то, чего больше нет в data
+                stale_users = set(row[0] for row in conn.execute("SELECT user_id FROM users")) - set(users)
+                stale_pairs = set(row[0] for row in conn.execute("SELECT pair_id FROM pairs")) - set(pairs)
+            else:
+                stale_users, stale_pairs = changes.deleted_users, changes.deleted_pairs
+            conn.executemany("DELETE FROM users WHERE user_id = ?", [(k,) for k in stale_users])
+            conn.executemany("DELETE FROM pairs WHERE pair_id = ?", [(k,) for k in stale_pairs])
+
+            # Сохраняем пользователей
+            conn.executemany(
+                "INSERT INTO users (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                [(user_id, json.dumps(users[user_id], ensure_ascii=False)) for user_id in user_ids]
             )
-        
-        # Сохраняем пары
-        for pair_id, pair_data in data["pairs"].items():
-            cursor.execute(
-                "INSERT INTO pairs (pair_id, data) VALUES (?, ?)",
-                (pair_id, json.dumps(pair_data, ensure_ascii=False))
+
+            # Сохраняем пары
+            conn.executemany(
+                "INSERT INTO pairs (pair_id, data) VALUES (?, ?) "
+                "ON CONFLICT(pair_id) DO UPDATE SET data = excluded.data",
+                [(pair_id, json.dumps(pairs[pair_id], ensure_ascii=False)) for pair_id in pair_ids]
             )
-        
-        conn.commit()
-        conn.close()
+
+        if changes is not None:
+            changes.clear()
 
 #zfdf
@@ -0,0 +1,62 @@
+from persistence import AppendLog, load_json
+
+
+class LikesGraph:
+    """Граф лайков в памяти: исходящие и входящие множества для каждого
+    пользователя. На диск пишется только журнал новых лайков.
+
+    log - путь к файлу журнала или объект с тем же интерфейсом, что у
+    AppendLog (например, таблица likes в SQLite).
+    """
+
+    def __init__(self, log, legacy_path=None):
+        self.log = AppendLog(log) if isinstance(log, str) else log
+        self.legacy_path = legacy_path
+        self._outgoing = {}
+        self._incoming = {}
+
+    def load(self):
+        self._outgoing = {}
+        self._incoming = {}
+        if not self.log.exists() and self.legacy_path:
+            # Первый запуск после likes.json: переносим лайки в журнал
+            legacy = load_json(self.legacy_path, {})
+            records = [
+                {'from': int(str_from), 'to': int(str_to)}
+                for str_from, liked in legacy.items()
+                for str_to in liked
+            ]
+            self.log.rewrite(records)
+        for record in self.log.replay():
+            self._add(record['from'], record['to'])
+
+    def _add(self, from_user_id, to_user_id):
+        outgoing = self._outgoing.setdefault(from_user_id, set())
+        if to_user_id in outgoing:
+            return False
+        outgoing.add(to_user_id)
+        self._incoming.setdefault(to_user_id, set()).add(from_user_id)
+        return True
+
+    def like(self, from_user_id, to_user_id):
+        """Ставит лайк и возвращает True, если лайк взаимный"""
+        if self._add(from_user_id, to_user_id):
+            self.log.append({'from': from_user_id, 'to': to_user_id})
+        return self.likes(to_user_id, from_user_id)
+
+    def likes(self, from_user_id, to_user_id):
+        return to_user_id in self._outgoing.get(from_user_id, ())
+
+    def is_mutual(self, user1_id, user2_id):
+        return self.likes(user1_id, user2_id) and self.likes(user2_id, user1_id)
+
+    def liked_by(self, user_id):
+        """Кому пользователь поставил лайк"""
+        return self._outgoing.get(user_id, set())
+
+    def likers_of(self, user_id):
+        """Кто поставил лайк пользователю"""
+        return self._incoming.get(user_id, set())
+
+    def close(self):
+        self.log.close()
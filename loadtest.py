@@ -0,0 +1,438 @@
+"""Нагрузочный тест бота целиком без выхода в сеть.
+
+Поднимает локальную замену Bot API (getUpdates, sendMessage, sendPhoto,
+editMessageMedia, editMessageText, answerCallbackQuery и др.), запускает
+main.py с BOT_API_BASE_URL, указывающим на неё, и проводит тысячи
+имитированных пользователей через создание анкеты, поиск и лайки/пропуски.
+
+    python loadtest.py --users 2000 --swipes 20 --latency-ms 30 --error-rate 0.01
+
+В конце выводятся пропускная способность (обновлений в секунду), время
+ответа бота по шагам (p50/p95/p99), число вызовов API по методам и число
+ответов 429. С --no-spawn бот не запускается: можно подключить уже
+работающий процесс с тем же BOT_TOKEN и BOT_API_BASE_URL.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+from metrics import percentile
+from webhook import read_request
+
+TOKEN = '123456:LOADTEST'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Бот', 'username': 'loadtest_bot'}
+
+# Методы, на которые не действуют задержка и 429
+SERVICE_METHODS = {'getMe', 'getUpdates', 'deleteWebhook', 'setWebhook', 'close'}
+
+# Поля, которые всегда строки, даже если выглядят как JSON
+RAW_FIELDS = {'text', 'caption', 'photo', 'callback_query_id'}
+
+
+def inline_markup(params):
+    """reply_markup для объекта Message: как и настоящий Bot API, в
+    сообщении возвращается только inline-клавиатура, а обычная
+    клавиатура и её удаление не возвращаются"""
+    markup = params.get('reply_markup')
+    if isinstance(markup, dict) and 'inline_keyboard' in markup:
+        return markup
+    return None
+
+
+def photo_sizes(file_id):
+    return [{'file_id': file_id, 'file_unique_id': 'u' + file_id, 'width': 640, 'height': 640}]
+
+
+def parse_params(headers, body):
+    """Параметры запроса PTB: JSON или форма, в которой сложные значения - JSON"""
+    if not body:
+        return {}
+    if headers.get('content-type', '').startswith('application/json'):
+        return json.loads(body)
+    params = {}
+    for name, values in parse_qs(body.decode('utf-8'), keep_blank_values=True).items():
+        value = values[-1]
+        if name not in RAW_FIELDS:
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        params[name] = value
+    return params
+
+
+class FakeBotApi:
+    """Замена Bot API: отдаёт боту обновления и запоминает его ответы"""
+
+    def __init__(self, latency=0.0, error_rate=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._updates = []
+        self._new_update = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.messages = {}
+        self.chat_events = {}
+        self.calls = Counter()
+        self.rejected = 0
+        self.delivered = 0
+        self._server = None
+
+    # --- Обновления от пользователей ---
+
+    def push_update(self, payload):
+        update = dict(payload, update_id=next(self._update_ids))
+        self._updates.append(update)
+        self._new_update.set()
+        return update['update_id']
+
+    def events(self, chat_id):
+        queue = self.chat_events.get(chat_id)
+        if queue is None:
+            queue = self.chat_events[chat_id] = asyncio.Queue()
+        return queue
+
+    async def get_updates(self, params):
+        offset = params.get('offset') or 0
+        limit = params.get('limit') or 100
+        timeout = params.get('timeout') or 0
+        # Подтверждённые ботом обновления (id < offset) удаляем
+        confirmed = 0
+        while confirmed < len(self._updates) and self._updates[confirmed]['update_id'] < offset:
+            confirmed += 1
+        if confirmed:
+            self.delivered += confirmed
+            del self._updates[:confirmed]
+        if not self._updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    # --- Сообщения бота ---
+
+    def _message(self, params, **fields):
+        chat_id = params['chat_id']
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            **fields,
+        }
+        markup = inline_markup(params)
+        if markup:
+            message['reply_markup'] = markup
+        self.messages[(chat_id, message['message_id'])] = message
+        return message
+
+    def _edit(self, params, **fields):
+        message = self.messages.get((params.get('chat_id'), params.get('message_id')))
+        if message is None:
+            raise LookupError("Bad Request: message to edit not found")
+        # Как и настоящий Bot API, не превращаем текст в фото и наоборот
+        if 'text' in fields and 'photo' in message:
+            raise LookupError("Bad Request: there is no text in the message to edit")
+        if 'photo' in fields and 'photo' not in message:
+            raise LookupError("Bad Request: there is no media in the message to edit")
+        if 'caption' in fields and 'photo' not in message:
+            raise LookupError("Bad Request: there is no caption in the message to edit")
+        message.update(fields)
+        message['edit_date'] = int(time.time())
+        markup = inline_markup(params)
+        if markup:
+            message['reply_markup'] = markup
+        else:
+            message.pop('reply_markup', None)
+        return message
+
+    def _notify(self, method, message):
+        self.events(message['chat']['id']).put_nowait((time.monotonic(), method, message))
+
+    async def call(self, method, params):
+        if method == 'getUpdates':
+            return await self.get_updates(params)
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('deleteWebhook', 'setWebhook', 'answerCallbackQuery', 'close'):
+            return True
+        if method == 'sendMessage':
+            message = self._message(params, text=params['text'])
+        elif method == 'sendPhoto':
+            message = self._message(params, photo=photo_sizes(params['photo']), caption=params.get('caption'))
+        elif method == 'editMessageText':
+            message = self._edit(params, text=params['text'])
+        elif method == 'editMessageCaption':
+            message = self._edit(params, caption=params.get('caption'))
+        elif method == 'editMessageMedia':
+            media = params['media']
+            message = self._edit(params, photo=photo_sizes(media['media']), caption=media.get('caption'))
+        elif method == 'deleteMessage':
+            if self.messages.pop((params['chat_id'], params['message_id']), None) is None:
+                raise LookupError("Bad Request: message to delete not found")
+            return True
+        else:
+            raise NotImplementedError(method)
+        self._notify(method, message)
+        return message
+
+    # --- HTTP ---
+
+    async def _handle(self, method, body):
+        if method not in SERVICE_METHODS:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.rejected += 1
+                return 429, {
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self.retry_after}",
+                    'parameters': {'retry_after': self.retry_after},
+                }
+        try:
+            return 200, {'ok': True, 'result': await self.call(method, body)}
+        except LookupError as e:
+            return 400, {'ok': False, 'error_code': 400, 'description': e.args[0]}
+        except NotImplementedError:
+            return 404, {'ok': False, 'error_code': 404, 'description': "Not Found: method not found"}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                _, target, headers, body = request
+                # Путь вида /bot<токен>/<метод>
+                method = target.split('?', 1)[0].rsplit('/', 1)[-1]
+                self.calls[method] += 1
+                status, response = await self._handle(method, parse_params(headers, body))
+                data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Остановка посреди долгого getUpdates: соединение просто закрываем
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+# --- Имитация пользователей ---
+
+def has_card(message):
+    return 'inline_keyboard' in message.get('reply_markup', {})
+
+
+class SimulatedUser:
+    _query_ids = itertools.count(1)
+
+    def __init__(self, api, user_id, rng, timeout):
+        self.api = api
+        self.user_id = user_id
+        self.rng = rng
+        self.timeout = timeout
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': 'Тест', 'username': f'load{user_id}'}
+        self.card = None
+
+    def _message_update(self, text=None, photo=None):
+        message = {
+            'message_id': next(self.api.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': self.user_id, 'type': 'private'},
+            'from': self.user,
+        }
+        if photo:
+            message['photo'] = photo_sizes(photo)
+        else:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'message': message}
+
+    def _callback_update(self, data):
+        return {'callback_query': {
+            'id': str(next(self._query_ids)),
+            'from': self.user,
+            'chat_instance': str(self.user_id),
+            'data': data,
+            'message': self.card,
+        }}
+
+    async def step(self, name, payload, stats, expect=None):
+        """Отправляет обновление и ждёт подходящего ответа бота"""
+        events = self.api.events(self.user_id)
+        # Ответы на прошлые шаги (например, уведомления) не считаем
+        while not events.empty():
+            events.get_nowait()
+        started = time.monotonic()
+        self.api.push_update(payload)
+        deadline = started + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                stats.timeouts[name] += 1
+                return None
+            try:
+                at, method, message = await asyncio.wait_for(events.get(), remaining)
+            except asyncio.TimeoutError:
+                continue
+            if expect is None or expect(message):
+                stats.latency.setdefault(name, []).append((at - started) * 1000)
+                return message
+
+    async def run(self, swipes, stats, think):
+        rng = self.rng
+        gender = rng.choice(('мужской', 'женский'))
+        age = rng.randint(18, 50)
+        flow = [
+            ('start', self._message_update('/start')),
+            ('menu', self._message_update('Создать/обновить анкету')),
+            ('gender', self._message_update(gender)),
+            ('age', self._message_update(str(age))),
+            ('about', self._message_update('люблю кино')),
+            ('target_gender', self._message_update('женский' if gender == 'мужской' else 'мужской')),
+            ('age_range', self._message_update(f'{max(13, age - 5)}-{age + 5}')),
+        ]
+        if rng.random() < 0.7:
+            flow.append(('photo', self._message_update(photo=f'photo-{self.user_id}')))
+        else:
+            flow.append(('photo', self._message_update('/skip')))
+        for name, payload in flow:
+            if await self.step(name, payload, stats) is None:
+                return
+            await asyncio.sleep(think)
+
+        is_card = lambda message: has_card(message) or 'закончились' in (message.get('text') or message.get('caption') or '')
+        found = lambda message: is_card(message) or 'не найдено' in (message.get('text') or '')
+        self.card = await self.step('search', self._message_update('Искать собеседника'), stats, expect=found)
+        for _ in range(swipes):
+            if not self.card or not has_card(self.card):
+                return
+            await asyncio.sleep(think)
+            buttons = self.card['reply_markup']['inline_keyboard'][0]
+            button = buttons[0] if rng.random() < 0.4 else buttons[1]
+            action = button['callback_data'].split('_')[0]
+            self.card = await self.step(action, self._callback_update(button['callback_data']), stats, expect=is_card)
+
+
+class Stats:
+    def __init__(self):
+        self.latency = {}
+        self.timeouts = Counter()
+
+
+def report(api, stats, duration, users):
+    total = sum(len(values) for values in stats.latency.values())
+    print(f"\nПользователей: {users}, время: {duration:.1f} с")
+    print(f"Обработано обновлений: {api.delivered} ({api.delivered / duration:.1f} в секунду)")
+    print(f"Ответов бота дождались: {total}, не дождались: {sum(stats.timeouts.values())}")
+    print(f"\n{'шаг':<16}{'n':>8}{'p50, мс':>12}{'p95, мс':>12}{'p99, мс':>12}{'таймауты':>10}")
+    for name, values in sorted(stats.latency.items()):
+        values.sort()
+        print(
+            f"{name:<16}{len(values):>8}{percentile(values, 50):>12.1f}{percentile(values, 95):>12.1f}"
+            f"{percentile(values, 99):>12.1f}{stats.timeouts[name]:>10}"
+        )
+    print("\nВызовы API: " + ", ".join(f"{method}={count}" for method, count in api.calls.most_common()))
+    print(f"Отвечено 429: {api.rejected}")
+
+
+def spawn_bot(base_url, data_dir, extra_env):
+    env = dict(
+        os.environ,
+        BOT_TOKEN=TOKEN,
+        BOT_API_BASE_URL=base_url,
+        BOT_DATA_DIR=data_dir,
+        BOT_MODE='polling',
+        BOT_POLL_TIMEOUT='5',
+        **extra_env,
+    )
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    return subprocess.Popen([sys.executable, main_py], env=env)
+
+
+async def run(args):
+    api = FakeBotApi(latency=args.latency_ms / 1000, error_rate=args.error_rate, seed=args.seed)
+    await api.start(args.host, args.port)
+    base_url = f'http://{args.host}:{args.port}/bot'
+    print(f"Bot API: {base_url}")
+
+    bot = None
+    data_dir = None
+    if not args.no_spawn:
+        data_dir = tempfile.TemporaryDirectory(prefix='loadtest-')
+        bot = spawn_bot(base_url, data_dir.name, dict(item.split('=', 1) for item in args.bot_env))
+        # Ждём, пока бот начнёт опрашивать getUpdates
+        while api.calls['getUpdates'] == 0:
+            if bot.poll() is not None:
+                raise SystemExit("Бот завершился при запуске")
+            await asyncio.sleep(0.1)
+
+    rng = random.Random(args.seed)
+    stats = Stats()
+    simulated = [SimulatedUser(api, 1000 + i, random.Random(rng.random()), args.timeout) for i in range(args.users)]
+
+    async def start_user(index, user):
+        await asyncio.sleep(args.ramp * index / max(1, args.users))
+        await user.run(args.swipes, stats, args.think_ms / 1000)
+
+    started = time.monotonic()
+    await asyncio.gather(*(start_user(i, user) for i, user in enumerate(simulated)))
+    duration = time.monotonic() - started
+    report(api, stats, duration, args.users)
+
+    if bot is not None:
+        bot.terminate()
+        try:
+            await asyncio.to_thread(bot.wait, 30)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        data_dir.cleanup()
+    await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с локальной заменой Bot API")
+    parser.add_argument('--users', type=int, default=1000, help="имитируемых пользователей")
+    parser.add_argument('--swipes', type=int, default=10, help="лайков/пропусков на пользователя")
+    parser.add_argument('--ramp', type=float, default=5.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument('--think-ms', type=float, default=0, help="пауза пользователя между шагами")
+    parser.add_argument('--latency-ms', type=float, default=0, help="задержка ответа Bot API")
+    parser.add_argument('--error-rate', type=float, default=0, help="доля запросов, получающих 429")
+    parser.add_argument('--timeout', type=float, default=30, help="сколько ждать ответа бота на шаг")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-spawn', action='store_true', help="не запускать бота, он уже запущен")
+    parser.add_argument('--bot-env', action='append', default=[], metavar='NAME=VALUE',
+                        help="дополнительная переменная окружения для бота, например BOT_STORAGE=sqlite")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обработка обновлений для Application.concurrent_updates.
+
+    Обновления разных пользователей обрабатываются параллельно (не больше
+    max_concurrent_updates одновременно), обновления одного пользователя -
+    строго в порядке поступления. Так ConversationHandler и user_data
+    каждого пользователя никогда не используются двумя обновлениями сразу.
+
+    Обновления одного пользователя выстраиваются в цепочку, и место в общем
+    лимите занимает только её голова: пользователь, приславший много
+    обновлений подряд, не забирает места у остальных, пока его обновления
+    ждут своей очереди.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._slots = None
+        # user_id -> future, которая завершится после последнего
+        # поставленного в цепочку обновления пользователя
+        self._tails = {}
+
+    async def process_update(self, update, coroutine):
+        if self._slots is None:
+            self._slots = asyncio.BoundedSemaphore(self.max_concurrent_updates)
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await self._run(update, coroutine)
+            return
+
+        previous = self._tails.get(user.id)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[user.id] = done
+        if previous is not None:
+            try:
+                # Ждём предыдущее обновление пользователя, не занимая места.
+                # shield: отмена этого обновления не должна отменять чужую future
+                await asyncio.shield(previous)
+            except asyncio.CancelledError:
+                coroutine.close()
+                # Следующие обновления пользователя по-прежнему ждут предыдущее
+                previous.add_done_callback(lambda _: self._release(user.id, done))
+                raise
+        try:
+            await self._run(update, coroutine)
+        finally:
+            self._release(user.id, done)
+
+    async def _run(self, update, coroutine):
+        """Выполняет обновление, заняв место в общем лимите"""
+        try:
+            await self._slots.acquire()
+        except asyncio.CancelledError:
+            coroutine.close()
+            raise
+        try:
+            await self.do_process_update(update, coroutine)
+        finally:
+            self._slots.release()
+
+    def _release(self, user_id, done):
+        if not done.done():
+            done.set_result(None)
+        if self._tails.get(user_id) is done:
+            del self._tails[user_id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
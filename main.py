@@ -1,14 +1,13 @@
+import asyncio
 import logging
-import json
 import os
+import sys
+import time
 
 from telegram import (
     Update,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
-    InlineKeyboardButton,
-    InlineKeyboardMarkup,
-    InputMediaPhoto,
 )
 from telegram.ext import (
     Application,
@@ -18,10 +17,39 @@ from telegram.ext import (
     ConversationHandler,
     ContextTypes,
     CallbackQueryHandler,
+    TypeHandler,
 )
-
-USERS_FILE = 'users.json'
-REVIEWS_FILE = 'reviews.json'
+from telegram.request import HTTPXRequest
+
+import config
+import database
+from profile_store import ProfileStore, PROFILE_FIELDS
+from matching import MatchIndex, SEARCH_FIELDS, search_params
+from ranking import Ranker
+from likes_store import LikesGraph
+from seen_store import SeenStore
+from activity_store import ActivityStore
+from reviews_store import ReviewsStore
+from cards import CardCache, render_card
+from card_view import PhotoRegistry, send_card, show_card, show_notice
+from persistence import BufferedLog, run_blocking
+from locks import PerUserUpdateProcessor
+import storage
+import webhook
+from state_persistence import SqlitePersistence
+from outbox import Outbox
+import metrics
+from metrics import timed
+from metered_request import MeteredRequest
+from recording import UpdateRecorder
+
+USERS_FILE = os.path.join(config.DATA_DIR, 'users.json')
+REVIEWS_FILE = os.path.join(config.DATA_DIR, 'reviews.json')
+# likes.json читается только при первом запуске, дальше лайки пишутся в журнал
+LIKES_FILE = os.path.join(config.DATA_DIR, 'likes.json')
+LIKES_LOG_FILE = os.path.join(config.DATA_DIR, 'likes.log')
+SEEN_LOG_FILE = os.path.join(config.DATA_DIR, 'seen.log')
+ACTIVITY_LOG_FILE = os.path.join(config.DATA_DIR, 'activity.log')
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
@@ -47,71 +75,139 @@ logger = logging.getLogger(__name__)
     REVIEW_ENTER_TEXT,
 ) = range(8, 10)
 
-def load_json(filename, default):
-    if os.path.exists(filename):
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return default
-
-def save_json(filename, data):
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-def get_users_list():
-    return load_json(USERS_FILE, [])
+# Данные хранятся либо в JSON-файлах, либо в SQLite (BOT_STORAGE=sqlite).
+# В обоих случаях они загружаются в память, а на диск пишутся изменения.
+if config.STORAGE_BACKEND == 'sqlite':
+    sqlite_storage = storage.Storage()
+    sqlite_storage.create_schema()
+    profiles_backend = storage.SqliteProfilesBackend(sqlite_storage)
+    reviews_backend = storage.SqliteReviewsBackend(sqlite_storage)
+    likes_backend = storage.likes_log(sqlite_storage)
+    seen_backend = storage.seen_log(sqlite_storage)
+    activity_backend = storage.activity_log(sqlite_storage)
+else:
+    profiles_backend = USERS_FILE
+    reviews_backend = REVIEWS_FILE
+    likes_backend = LIKES_LOG_FILE
+    seen_backend = SEEN_LOG_FILE
+    activity_backend = ACTIVITY_LOG_FILE
+
+# Состояния диалогов и user_data при любом BOT_STORAGE хранятся в bot.db
+state_storage = sqlite_storage if config.STORAGE_BACKEND == 'sqlite' else storage.Storage()
+
+# Анкеты загружаются один раз при запуске (см. init_storage) и живут в памяти
+profiles = ProfileStore(
+    profiles_backend,
+    flush_interval=config.FLUSH_INTERVAL,
+    flush_threshold=config.FLUSH_THRESHOLD,
+)
+# Индекс для поиска обновляется вместе с анкетами
+match_index = MatchIndex()
+profiles.add_listener(match_index.on_profile_changed)
+
+# Журналы лайков и пропусков дописываются в фоне, пачками
+likes = LikesGraph(BufferedLog(likes_backend), legacy_path=LIKES_FILE)
+# Пропущенные анкеты не показываются в поиске повторно
+seen = SeenStore(BufferedLog(seen_backend), limit=config.SEEN_LIMIT)
+# Время последней активности - один из признаков ранжирования в поиске
+activity = ActivityStore(BufferedLog(activity_backend), resolution=config.ACTIVITY_RESOLUTION)
+ranker = Ranker(
+    age_weight=config.RANK_AGE_WEIGHT,
+    photo_weight=config.RANK_PHOTO_WEIGHT,
+    reviews_weight=config.RANK_REVIEWS_WEIGHT,
+    recency_weight=config.RANK_RECENCY_WEIGHT,
+    recency_half_life=config.RANK_RECENCY_HALF_LIFE_HOURS * 3600,
+)
+# Отзывы тоже в памяти, для карточек хранится готовая сводка
+reviews = ReviewsStore(
+    reviews_backend,
+    flush_interval=config.FLUSH_INTERVAL,
+    flush_threshold=config.FLUSH_THRESHOLD,
+)
 
-def set_users_list(users):
-    save_json(USERS_FILE, users)
+# Готовые карточки анкет; сбрасываются при изменении анкеты или новом отзыве
+card_cache = CardCache(max_size=config.CARD_CACHE_SIZE)
+# Какие file_id фото анкет Telegram больше не принимает
+photo_registry = PhotoRegistry(max_size=config.CARD_CACHE_SIZE)
+profiles.add_listener(lambda profile: card_cache.invalidate(profile['user_id']))
+
+def invalidate_reviewed_card(username):
+    profile = profiles.find_by_username(username)
+    if profile:
+        card_cache.invalidate(profile['user_id'])
+
+reviews.add_listener(invalidate_reviewed_card)
+
+def init_storage():
+    state_storage.create_schema()
+    profiles.load()
+    match_index.rebuild(profiles.all())
+    likes.load()
+    seen.load()
+    activity.load()
+    reviews.load()
+
+async def start_storage(application):
+    profiles.start()
+    reviews.start()
+    likes.log.start()
+    seen.log.start()
+    activity.log.start()
+    outbox.start(application.bot)
+    await metrics_exporter.start()
+    if recorder is not None:
+        recorder.start()
+
+async def stop_outbox(application):
+    # Вызывается до закрытия соединений бота, чтобы очередь успела отправиться
+    await outbox.stop()
+
+async def stop_storage(application):
+    await metrics_exporter.stop()
+    if recorder is not None:
+        await recorder.stop()
+    await profiles.stop()
+    await reviews.stop()
+    await likes.log.stop()
+    await seen.log.stop()
+    await activity.log.stop()
+    likes.close()
+    seen.close()
+    activity.close()
+
+# Уведомления отправляются в фоне с учётом лимитов Telegram
+outbox = Outbox(
+    workers=config.OUTBOX_WORKERS,
+    rate=config.OUTBOX_RATE,
+    chat_interval=config.OUTBOX_CHAT_INTERVAL,
+    max_retries=config.OUTBOX_MAX_RETRIES,
+)
 
-def get_reviews():
-    return load_json(REVIEWS_FILE, {})
+# Сводка замеров (BOT_METRICS=1) в лог и по HTTP
+metrics_exporter = metrics.Exporter(log_interval=config.METRICS_LOG_INTERVAL, port=config.METRICS_PORT)
 
-def set_reviews(reviews):
-    save_json(REVIEWS_FILE, reviews)
+# Запись обновлений для replay.py (BOT_RECORD_FILE)
+recorder = UpdateRecorder(config.RECORD_FILE, config.RECORD_KEY) if config.RECORD_FILE else None
 
 def find_user_by_id(user_id):
-    users_list = get_users_list()
-    for u in users_list:
-        if u['user_id'] == user_id:
-            return u
-    return None
+    return profiles.get(user_id)
 
 def find_user_by_username(username):
-    users_list = get_users_list()
-    username = username.lstrip('@').lower()
-    for u in users_list:
-        if 'username' in u and u['username'].lower() == username:
-            return u
-    return None
-
-# --- Добавим хранилище лайков в память (можно заменить на файл при необходимости) ---
-# Формат: {user_id: set(user_id_которым поставлен лайк)}
-LIKES_FILE = 'likes.json'
-
-def get_likes():
-    return load_json(LIKES_FILE, {})
+    return profiles.find_by_username(username)
 
-def set_likes(data):
-    save_json(LIKES_FILE, data)
+# --- Лайки ---
+# Граф лайков хранится в памяти (LikesGraph), на диск пишется журнал likes.log
 
 def add_like(from_user_id, to_user_id):
-    likes = get_likes()
-    str_from = str(from_user_id)
-    str_to = str(to_user_id)
-    if str_from not in likes:
-        likes[str_from] = []
-    if str_to not in likes[str_from]:
-        likes[str_from].append(str_to)
-    set_likes(likes)
+    """Ставит лайк, возвращает True если он взаимный"""
+    return likes.like(from_user_id, to_user_id)
 
 def check_mutual_like(user1_id, user2_id):
-    likes = get_likes()
-    str_user1 = str(user1_id)
-    str_user2 = str(user2_id)
-    return (str_user1 in likes and str_user2 in likes[str_user1]) and (str_user2 in likes and str_user1 in likes[str_user2])
+    return likes.is_mutual(user1_id, user2_id)
 
 # --- Главное меню ---
 
+@timed
 async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         ["Создать/обновить анкету", "Искать собеседника"],
@@ -123,9 +219,13 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     )
 
+@timed
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.message.from_user
+    await database.run(database.add_user, user.id, user.username, user.first_name, user.last_name)
     await main_menu(update, context)
 
+@timed
 async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.lower()
     if text == "создать/обновить анкету":
@@ -149,6 +249,7 @@ async def handle_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- Создание/обновление анкеты ---
 
+@timed
 async def choose_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     gender = update.message.text.lower()
     if gender not in ['мужской', 'женский', 'другой']:
@@ -158,6 +259,7 @@ async def choose_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Сколько тебе лет?", reply_markup=ReplyKeyboardRemove())
     return ENTER_AGE
 
+@timed
 async def enter_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         age = int(update.message.text)
@@ -171,6 +273,7 @@ async def enter_age(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Расскажи немного о себе (несколько слов):")
     return ENTER_ABOUT
 
+@timed
 async def enter_about(update: Update, context: ContextTypes.DEFAULT_TYPE):
     about = update.message.text
     context.user_data['about'] = about
@@ -181,6 +284,7 @@ async def enter_about(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return CHOOSE_TARGET_GENDER
 
+@timed
 async def choose_target_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     target_gender = update.message.text.lower()
     if target_gender not in ['мужской', 'женский', 'любой']:
@@ -193,6 +297,7 @@ async def choose_target_gender(update: Update, context: ContextTypes.DEFAULT_TYP
     )
     return ENTER_AGE_RANGE
 
+@timed
 async def enter_age_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     try:
@@ -213,10 +318,12 @@ async def enter_age_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return UPLOAD_PHOTO
 
+@timed
 async def upload_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.photo:
         photo = update.message.photo[-1]
         context.user_data['photo_id'] = photo.file_id
+        photo_registry.confirm(photo.file_id)
     else:
         context.user_data['photo_id'] = None
 
@@ -225,18 +332,10 @@ async def upload_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['username'] = username
 
     user_id = update.message.from_user.id
-    users_list = get_users_list()
-    found = False
-    for u in users_list:
-        if u['user_id'] == user_id:
-            u.update(context.user_data)
-            found = True
-            break
-    if not found:
-        new_user = context.user_data.copy()
-        new_user['user_id'] = user_id
-        users_list.append(new_user)
-    set_users_list(users_list)
+    # В анкету попадают только её поля, служебные данные user_data не сохраняем
+    fields = {k: v for k, v in context.user_data.items() if k in PROFILE_FIELDS}
+    profiles.update(user_id, fields)
+    activity.touch(user_id)
 
     await update.message.reply_text(
         "Анкета создана/обновлена! Теперь ты можешь искать собеседников.\n"
@@ -250,113 +349,142 @@ async def upload_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
+@timed
 async def skip_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['photo_id'] = None
     return await upload_photo(update, context)
 
 # --- Поиск и просмотр анкет с лайками и отзывами ---
 
-async def show_profile(update_obj, context, profiles, index):
-    if index >= len(profiles):
-        if hasattr(update_obj, 'callback_query') and update_obj.callback_query:
-            await update_obj.callback_query.edit_message_text("Анкеты закончились.")
+def get_card(profile):
+    user_id = profile['user_id']
+    version = profiles.version(user_id)
+    card = card_cache.get(user_id, version)
+    if card is None:
+        # Первые отзывы и количество остальных берём из готовой сводки
+        top_reviews, more_reviews = reviews.summary(profile.get('username', ''))
+        card = render_card(profile, top_reviews, more_reviews)
+        card_cache.put(user_id, version, card)
+    return card
+
+@timed
+async def show_profile(update, context, profile):
+    """После нажатия кнопки карточка показывается в том же сообщении,
+    иначе отправляется новым"""
+    query = update.callback_query
+    if profile is None:
+        if query:
+            await show_notice(query.message, "Анкеты закончились.")
         else:
-            await update_obj.message.reply_text("Анкеты закончились.")
+            await update.message.reply_text("Анкеты закончились.")
         return
 
-    profile = profiles[index]
-    username = profile.get('username', 'не указан')
-    
-    # Получаем отзывы для этого пользователя
-    reviews = get_reviews()
-    user_reviews = reviews.get(username.lower(), [])
-    
-    # Формируем текст анкеты
-    text = (
-        f"👤 {profile.get('name_age', 'Пользователь')}\n"
-        f"Пол: {profile['gender']}\n"
-        f"Возраст: {profile['age']}\n"
-        f"О себе: {profile['about']}\n"
-    )
-    
-    # Добавляем отзывы, если они есть
-    if user_reviews:
-        text += "📝 Отзывы:\n"
-        for i, review in enumerate(user_reviews[:3], 1):  # Показываем первые 3 отзыва
-            text += f"{i}. {review}\n"
-        if len(user_reviews) > 3:
-            text += f"... и ещё {len(user_reviews)-3} отзывов\n"
-    else:
-        text += "Отзывов пока нет\n"
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("👍 Нравится", callback_data=f"like_{index}"),
-            InlineKeyboardButton("➡️ Пропустить", callback_data=f"skip_{index}")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    if 'photo_id' in profile and profile['photo_id']:
-        if hasattr(update_obj, 'callback_query') and update_obj.callback_query:
-            await update_obj.callback_query.edit_message_media(
-                media=InputMediaPhoto(profile['photo_id'], caption=text),
-                reply_markup=reply_markup
-            )
-        else:
-            await update_obj.message.reply_photo(
-                photo=profile['photo_id'],
-                caption=text,
-                reply_markup=reply_markup
-            )
+    card = get_card(profile)
+    if query:
+        await show_card(query.message, card, photo_registry)
     else:
-        if hasattr(update_obj, 'callback_query') and update_obj.callback_query:
-            await update_obj.callback_query.edit_message_text(text, reply_markup=reply_markup)
-        else:
-            await update_obj.message.reply_text(text, reply_markup=reply_markup)
+        await send_card(context.bot, update.effective_chat.id, card, photo_registry)
+
+def new_search_cursor(user):
+    """Курсор поиска: параметры запроса и очередь лучших кандидатов.
+
+    Хранится в user_data вместо списка всех найденных анкет. В очереди
+    не больше RANK_QUEUE_SIZE user_id; когда она кончается, кандидаты
+    заново отбираются из индекса и ранжируются.
+    """
+    cursor = {field: user[field] for field in SEARCH_FIELDS}
+    cursor['queue'] = []
+    return cursor
+
+async def precomputed_queue(user):
+    """Очередь кандидатов из precompute.py или пустой список, если её нет,
+    она устарела или построена для других параметров поиска"""
+    row = await run_blocking(state_storage.get_recommendations, user['user_id'])
+    if row is None:
+        return []
+    params, candidates, built_at = row
+    if params != search_params(user) or time.time() - built_at > config.RECOMMENDATIONS_MAX_AGE_HOURS * 3600:
+        return []
+    return candidates
+
+def review_count(profile):
+    username = profile.get('username')
+    return reviews.count(username) if username else 0
+
+def rank_candidates(cursor, liked, skipped):
+    """user_id лучших ещё не оценённых кандидатов для курсора"""
+    groups = (
+        (age, (
+            profiles.get(candidate_id) for candidate_id in candidate_ids
+            # Пропускаем уже оценённые анкеты: лайкнутые и пропущенные
+            if candidate_id not in liked and candidate_id not in skipped
+        ))
+        for age, candidate_ids in match_index.iter_match_by_age(cursor, two_sided=config.SEARCH_TWO_SIDED)
+    )
+    return ranker.top_by_age(
+        cursor, groups, config.RANK_QUEUE_SIZE, review_count, activity.last_active, limit=config.RANK_MAX_SCORED,
+    )
+
+def next_candidate(cursor):
+    """Следующая анкета из очереди курсора или None"""
+    user_id = cursor['user_id']
+    liked = likes.liked_by(user_id)
+    skipped = seen.seen_by(user_id)
+    queue = cursor['queue']
+    for refill in (False, True):
+        if refill:
+            queue = rank_candidates(cursor, liked, skipped)
+        while queue:
+            candidate_id = queue.pop(0)
+            profile = profiles.get(candidate_id)
+            # Пока кандидат ждал в очереди, его могли уже оценить
+            if profile is not None and candidate_id not in liked and candidate_id not in skipped:
+                cursor['queue'] = queue
+                return profile
+    cursor['queue'] = []
+    return None
 
+@timed
 async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     user = find_user_by_id(user_id)
     if not user:
         await update.message.reply_text("Сначала создай анкету.")
         return ConversationHandler.END
-    users_list = get_users_list()
-    results = [
-        u for u in users_list
-        if u['user_id'] != user_id and
-           (user['target_gender'].lower() == 'любой' or u['gender'].lower() == user['target_gender'].lower()) and
-           (user['age_min'] <= u['age'] <= user['age_max'])
-    ]
-    if not results:
+    activity.touch(user_id)
+    cursor = context.user_data.get('search_cursor')
+    # Пока анкета не менялась, продолжаем уже отобранную очередь
+    if not cursor or any(cursor.get(field) != user[field] for field in SEARCH_FIELDS):
+        cursor = new_search_cursor(user)
+        cursor['queue'] = await precomputed_queue(user)
+    profile = next_candidate(cursor)
+    if profile is None:
         await update.message.reply_text("По вашим параметрам собеседников не найдено.")
         return ConversationHandler.END
-    context.user_data['search_results'] = results
-    context.user_data['search_index'] = 0
-    await show_profile(update, context, results, 0)
+    context.user_data['search_cursor'] = cursor
+    await show_profile(update, context, profile)
 
+@timed
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     data = query.data
-    index = context.user_data.get('search_index', 0)
-    results = context.user_data.get('search_results', [])
-    if not results:
-        await query.edit_message_text("Нет анкет для показа.")
+    cursor = context.user_data.get('search_cursor')
+    if not cursor:
+        await query.answer()
+        await show_notice(query.message, "Нет анкет для показа.")
         return
 
     if data.startswith("like_"):
-        # Лайкнули анкету с индексом
-        liked_index = int(data.split('_')[1])
-        liked_user = results[liked_index]
+        # Лайкнули анкету пользователя с этим user_id
         liker_id = query.from_user.id
-        liked_id = liked_user['user_id']
+        liked_id = int(data.split('_')[1])
 
-        add_like(liker_id, liked_id)
+        # Лайк и проверка взаимности - одна операция
+        mutual = add_like(liker_id, liked_id)
+        activity.touch(liker_id)
         await query.answer("Вы поставили лайк!")
 
-        # Проверяем взаимный лайк
-        if check_mutual_like(liker_id, liked_id):
+        if mutual:
             # Отправляем уведомления обоим пользователям
             liker = find_user_by_id(liker_id)
             liked = find_user_by_id(liked_id)
@@ -364,46 +492,34 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 liker_name = liker.get('username') or f"Пользователь {liker_id}"
                 liked_name = liked.get('username') or f"Пользователь {liked_id}"
 
-                try:
-                    await context.bot.send_message(
-                        chat_id=liker_id,
-                        text=f"У вас взаимный лайк с @{liked_name}! Вот его анкета:\n"
-                             f"Пол: {liked['gender']}\nВозраст: {liked['age']}\nО себе: {liked['about']}\nTelegram: @{liked.get('username', 'не указан')}"
-                    )
-                    await context.bot.send_message(
-                        chat_id=liked_id,
-                        text=f"У вас взаимный лайк с @{liker_name}! Вот его анкета:\n"
-                             f"Пол: {liker['gender']}\nВозраст: {liker['age']}\nО себе: {liker['about']}\nTelegram: @{liker.get('username', 'не указан')}"
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке уведомления о взаимном лайке: {e}")
-
-        index = liked_index + 1
-        context.user_data['search_index'] = index
-        if index < len(results):
-            await show_profile(query, context, results, index)
-        else:
-            await query.edit_message_text("Анкеты закончились.")
+                # Не ждём доставки: ошибки отправки пишет в лог outbox
+                outbox.send_message(
+                    liker_id,
+                    f"У вас взаимный лайк с @{liked_name}! Вот его анкета:\n"
+                    f"Пол: {liked['gender']}\nВозраст: {liked['age']}\nО себе: {liked['about']}\nTelegram: @{liked.get('username', 'не указан')}"
+                )
+                outbox.send_message(
+                    liked_id,
+                    f"У вас взаимный лайк с @{liker_name}! Вот его анкета:\n"
+                    f"Пол: {liker['gender']}\nВозраст: {liker['age']}\nО себе: {liker['about']}\nTelegram: @{liker.get('username', 'не указан')}"
+                )
+
+        await show_profile(update, context, next_candidate(cursor))
 
     elif data.startswith("skip_"):
-        skip_index = int(data.split('_')[1])
+        skip_id = int(data.split('_')[1])
+        seen.mark(query.from_user.id, skip_id)
+        activity.touch(query.from_user.id)
         await query.answer("Анкета пропущена.")
-        index = skip_index + 1
-        context.user_data['search_index'] = index
-        if index < len(results):
-            await show_profile(query, context, results, index)
-        else:
-            await query.edit_message_text("Анкеты закончились.")
+        await show_profile(update, context, next_candidate(cursor))
 
     elif data.startswith("reviews_"):
-        rev_index = int(data.split('_')[1])
-        profile = results[rev_index]
-        username = profile.get('username')
+        profile = find_user_by_id(int(data.split('_')[1]))
+        username = profile.get('username') if profile else None
         if not username:
             await query.answer("У этого пользователя нет username, отзывы недоступны.", show_alert=True)
             return
-        reviews = get_reviews()
-        user_reviews = reviews.get(username.lower(), [])
+        user_reviews = reviews.get(username)
         if not user_reviews:
             text = "Отзывов о пользователе пока нет."
         else:
@@ -414,8 +530,12 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             logger.error(f"Ошибка при отправке отзывов: {e}")
 
+    else:
+        await query.answer()
+
 # --- Редактирование профиля ---
 
+@timed
 async def edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = find_user_by_id(update.message.from_user.id)
     if not user:
@@ -433,6 +553,7 @@ async def edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return EDIT_CHOOSE_FIELD
 
+@timed
 async def edit_choose_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
     choice = update.message.text.lower()
     if choice == 'отмена':
@@ -466,19 +587,20 @@ async def edit_choose_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return EDIT_FIELD
     return EDIT_FIELD
 
+@timed
 async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
     field = context.user_data.get('edit_field')
     user_id = update.message.from_user.id
-    users_list = get_users_list()
-    user = next((u for u in users_list if u['user_id'] == user_id), None)
-    if not user:
+    if user_id not in profiles:
         await update.message.reply_text("Ошибка: профиль не найден.")
         return ConversationHandler.END
 
+    changes = {}
     if field == 'photo':
         if update.message.photo:
             photo = update.message.photo[-1]
-            user['photo_id'] = photo.file_id
+            changes['photo_id'] = photo.file_id
+            photo_registry.confirm(photo.file_id)
         else:
             await update.message.reply_text("Пожалуйста, отправьте фото или используйте /skip")
             return EDIT_FIELD
@@ -489,23 +611,23 @@ async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if text_lower not in ['мужской', 'женский', 'другой']:
                 await update.message.reply_text("Пожалуйста, выберите: Мужской, Женский или Другой")
                 return EDIT_FIELD
-            user['gender'] = text.capitalize()
+            changes['gender'] = text.capitalize()
         elif field == 'target_gender':
             if text_lower not in ['мужской', 'женский', 'любой']:
                 await update.message.reply_text("Пожалуйста, выберите: Мужской, Женский или Любой")
                 return EDIT_FIELD
-            user['target_gender'] = text.capitalize()
+            changes['target_gender'] = text.capitalize()
         elif field == 'age':
             try:
                 age = int(text)
                 if age < 13 or age > 120:
                     raise ValueError
-                user['age'] = age
+                changes['age'] = age
             except ValueError:
                 await update.message.reply_text("Введите корректный возраст (от 13 до 120):")
                 return EDIT_FIELD
         elif field == 'about':
-            user['about'] = text
+            changes['about'] = text
         elif field == 'age_range':
             try:
                 parts = text.split('-')
@@ -515,41 +637,41 @@ async def edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 age_max = int(parts[1])
                 if not (13 <= age_min <= age_max <= 120):
                     raise ValueError
-                user['age_min'] = age_min
-                user['age_max'] = age_max
+                changes['age_min'] = age_min
+                changes['age_max'] = age_max
             except ValueError:
                 await update.message.reply_text("Пожалуйста, введи корректный диапазон в формате: 20-30")
                 return EDIT_FIELD
 
-    set_users_list(users_list)
+    profiles.update(user_id, changes)
     await update.message.reply_text("Данные обновлены!", reply_markup=ReplyKeyboardRemove())
     await main_menu(update, context)
     return ConversationHandler.END
 
+@timed
 async def skip_photo_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
-    users_list = get_users_list()
-    for u in users_list:
-        if u['user_id'] == user_id:
-            u['photo_id'] = None
-            break
-    set_users_list(users_list)
+    if user_id in profiles:
+        profiles.update(user_id, {'photo_id': None})
     await update.message.reply_text("Фото удалено из профиля!", reply_markup=ReplyKeyboardRemove())
     await main_menu(update, context)
     return ConversationHandler.END
 
 # --- Отзывы ---
 
+@timed
 async def review_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Введите username пользователя, о котором хотите оставить отзыв (например, @username):")
     return REVIEW_ENTER_TARGET
 
+@timed
 async def review_enter_target(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.message.text.strip()
     context.user_data['review_target'] = username
     await update.message.reply_text(f"Вы оставляете отзыв пользователю {username}. Напишите текст отзыва:")
     return REVIEW_ENTER_TEXT
 
+@timed
 async def review_enter_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
     username = context.user_data.get('review_target')
@@ -563,31 +685,21 @@ async def review_enter_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return REVIEW_ENTER_TEXT
     
-    # Убедимся, что username начинается с @
-    if not username.startswith('@'):
-        username = '@' + username
-    
-    reviews = get_reviews()
-    key = username.lower().lstrip('@')
-    
-    if key not in reviews:
-        reviews[key] = []
-    
-    reviews[key].append(text)
-    set_reviews(reviews)
+    # Хранилище само приводит username к виду без @ в нижнем регистре
+    reviews.add(username, text)
     
     await update.message.reply_text("Ваш отзыв сохранён!", reply_markup=ReplyKeyboardRemove())
     await main_menu(update, context)
     return ConversationHandler.END
 
+@timed
 async def show_reviews(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.message.from_user.username
     if not username:
         await update.message.reply_text("У вас нет username, отзывы недоступны.")
         return
     
-    reviews = get_reviews()
-    user_reviews = reviews.get(username.lower(), [])
+    user_reviews = reviews.get(username)
     
     if not user_reviews:
         await update.message.reply_text("Отзывов о вас пока нет.")
@@ -602,8 +714,42 @@ async def show_reviews(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- Запуск бота ---
 
-def main():
-    application = Application.builder().token("8121277507:AAEvqSpC30D6kQzU1-ACkDgJ5FLomy7DKnc").build()
+def build_application(token=config.BOT_TOKEN):
+    # С включёнными замерами каждый вызов Bot API попадает в метрики
+    request_class = MeteredRequest if config.METRICS_ENABLED else HTTPXRequest
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_init(start_storage)
+        .post_stop(stop_outbox)
+        .post_shutdown(stop_storage)
+        # Диалоги и user_data переживают перезапуск
+        .persistence(SqlitePersistence(state_storage, update_interval=config.STATE_FLUSH_INTERVAL))
+        # Пул соединений для ответов пользователям и отдельный для getUpdates.
+        # Сокращения get_updates_* с собственным request использовать нельзя
+        .request(request_class(
+            connection_pool_size=config.CONNECTION_POOL_SIZE,
+            pool_timeout=config.POOL_TIMEOUT,
+            connect_timeout=config.CONNECT_TIMEOUT,
+            read_timeout=config.READ_TIMEOUT,
+            write_timeout=config.WRITE_TIMEOUT,
+        ))
+        .get_updates_request(request_class(
+            connection_pool_size=1,
+            pool_timeout=config.POOL_TIMEOUT,
+            connect_timeout=config.CONNECT_TIMEOUT,
+            # Длинный опрос держит соединение до POLL_TIMEOUT секунд
+            read_timeout=config.POLL_TIMEOUT + config.READ_TIMEOUT,
+            write_timeout=config.WRITE_TIMEOUT,
+        ))
+    )
+    if config.CONCURRENT_UPDATES > 1:
+        # Разные пользователи обрабатываются параллельно, один пользователь - по порядку
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(config.CONCURRENT_UPDATES))
+    if config.API_BASE_URL:
+        # Другой сервер Bot API, например локальный из loadtest.py
+        builder = builder.base_url(config.API_BASE_URL)
+    application = builder.build()
 
     conv_handler = ConversationHandler(
         entry_points=[
@@ -631,12 +777,38 @@ def main():
         },
         fallbacks=[CommandHandler("start", start)],
         allow_reentry=True,
+        name="main",
+        persistent=True,
     )
 
+    if recorder is not None:
+        # Группа -1 обрабатывается раньше остальных и не мешает им
+        application.add_handler(TypeHandler(Update, recorder.record), group=-1)
     application.add_handler(conv_handler)
     application.add_handler(CallbackQueryHandler(button_handler))
+    return application
+
+# Боту нужны только сообщения и нажатия на inline-кнопки
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
-    application.run_polling()
+def main():
+    if not config.BOT_TOKEN:
+        sys.exit("Не задан BOT_TOKEN: укажите токен бота в переменной окружения")
+    init_storage()
+    application = build_application()
+    if config.MODE == 'webhook':
+        asyncio.run(webhook.run_webhook(
+            application,
+            listen=config.WEBHOOK_LISTEN,
+            port=config.WEBHOOK_PORT,
+            path=config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET,
+            webhook_url=config.WEBHOOK_URL,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+        ))
+    else:
+        application.run_polling(timeout=config.POLL_TIMEOUT, allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == "__main__":
     main()
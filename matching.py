@@ -0,0 +1,153 @@
+ANY_GENDER = 'любой'
+
+# Поля анкеты, от которых зависит поиск (по ним же строится курсор поиска)
+SEARCH_FIELDS = ('user_id', 'gender', 'age', 'target_gender', 'age_min', 'age_max')
+
+
+def search_params(profile):
+    """Параметры поиска анкеты без user_id (для сверки готовых очередей)"""
+    return [profile.get(field) for field in SEARCH_FIELDS[1:]]
+
+
+class MatchIndex:
+    """Индекс анкет для поиска: корзины по полу, в каждой множества user_id
+    по возрасту. Поиск идёт по возрастам диапазона, от середины к краям.
+
+    Для взаимного поиска хранятся множества "кого принимает анкета":
+    (искомый пол, возраст) -> user_id тех, чьим предпочтениям он подходит.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._keys = {}
+        self._accepts = {}
+        self._prefs = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def rebuild(self, profiles):
+        self._buckets = {}
+        self._keys = {}
+        self._accepts = {}
+        self._prefs = {}
+        for profile in profiles:
+            self._add_prefs(profile)
+            key = self._key(profile)
+            if key is None:
+                continue
+            gender, age = key
+            self._keys[profile['user_id']] = key
+            self._buckets.setdefault(gender, {}).setdefault(age, set()).add(profile['user_id'])
+
+    @staticmethod
+    def _key(profile):
+        gender = profile.get('gender')
+        age = profile.get('age')
+        if not gender or age is None:
+            return None
+        return gender.lower(), age
+
+    @staticmethod
+    def _pref_key(profile):
+        target_gender = profile.get('target_gender')
+        age_min = profile.get('age_min')
+        age_max = profile.get('age_max')
+        if not target_gender or age_min is None or age_max is None:
+            return None
+        return target_gender.lower(), age_min, age_max
+
+    def _add_prefs(self, profile):
+        user_id = profile['user_id']
+        pref = self._pref_key(profile)
+        if self._prefs.get(user_id) == pref:
+            return
+        self._remove_prefs(user_id)
+        if pref is None:
+            return
+        self._prefs[user_id] = pref
+        target_gender, age_min, age_max = pref
+        for age in range(age_min, age_max + 1):
+            self._accepts.setdefault((target_gender, age), set()).add(user_id)
+
+    def _remove_prefs(self, user_id):
+        pref = self._prefs.pop(user_id, None)
+        if pref is None:
+            return
+        target_gender, age_min, age_max = pref
+        for age in range(age_min, age_max + 1):
+            accepted = self._accepts.get((target_gender, age))
+            if accepted is not None:
+                accepted.discard(user_id)
+
+    def add(self, profile):
+        self._add_prefs(profile)
+        user_id = profile['user_id']
+        key = self._key(profile)
+        if self._keys.get(user_id) == key:
+            return
+        self._remove_entry(user_id)
+        if key is None:
+            return
+        gender, age = key
+        self._keys[user_id] = key
+        self._buckets.setdefault(gender, {}).setdefault(age, set()).add(user_id)
+
+    def _remove_entry(self, user_id):
+        key = self._keys.pop(user_id, None)
+        if key is None:
+            return
+        gender, age = key
+        self._buckets[gender][age].discard(user_id)
+
+    def on_profile_changed(self, profile):
+        self.add(profile)
+
+    def _buckets_for(self, target_gender):
+        target_gender = target_gender.lower()
+        if target_gender == ANY_GENDER:
+            return list(self._buckets.values())
+        return [self._buckets.get(target_gender, {})]
+
+    def accepting(self, gender, age):
+        """Множества user_id анкет, чьим предпочтениям подходит пользователь
+        с таким полом и возрастом (искомый пол совпадает или "любой")"""
+        exact = self._accepts.get((gender.lower(), age), set())
+        any_gender = self._accepts.get((ANY_GENDER, age), set())
+        return exact, any_gender
+
+    def iter_match_by_age(self, profile, two_sided=True):
+        """Кандидаты для анкеты profile (без неё самой) группами по возрасту:
+        пары (возраст, список user_id по возрастанию), от середины искомого
+        диапазона к краям. Группы строятся по мере перебора.
+
+        При two_sided=True кандидат тоже должен подходить под предпочтения
+        profile по полу и возрасту: это пересечение множеств, без перебора
+        анкет в Python.
+        """
+        user_id = profile['user_id']
+        buckets = self._buckets_for(profile['target_gender'])
+        if two_sided:
+            # Не пересекаются: у анкеты один искомый пол
+            exact, any_gender = self.accepting(profile['gender'], profile['age'])
+        for age in ages_from_middle(profile['age_min'], profile['age_max']):
+            candidate_ids = []
+            for bucket in buckets:
+                users = bucket.get(age)
+                if not users:
+                    continue
+                if two_sided:
+                    candidate_ids.extend(users & exact)
+                    candidate_ids.extend(users & any_gender)
+                else:
+                    candidate_ids.extend(users)
+            candidate_ids.sort()
+            if user_id in candidate_ids:
+                candidate_ids.remove(user_id)
+            yield age, candidate_ids
+
+
+def ages_from_middle(age_min, age_max):
+    """Возрасты диапазона по удалённости от его середины (при равной - младше раньше)"""
+    middle = (age_min + age_max) / 2
+    return sorted(range(age_min, age_max + 1), key=lambda age: (abs(age - middle), age))
@@ -0,0 +1,17 @@
+import time
+
+from telegram.request import HTTPXRequest
+
+import metrics
+
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет время каждого вызова Bot API"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            # Последний сегмент URL - имя метода, например sendMessage
+            metrics.record_api(url.rsplit('/', 1)[-1], time.perf_counter() - started)
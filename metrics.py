@@ -0,0 +1,264 @@
+"""Замеры времени обработчиков, операций с хранилищем и вызовов Bot API.
+
+Включаются переменной BOT_METRICS=1. Когда замеры выключены,
+декоратор timed возвращает обработчик без изменений, а остальные
+функции сразу выходят.
+
+Для каждого обработчика собираются гистограммы: полное время, время
+операций с хранилищем, выполненных в самом обработчике, время и число
+вызовов Bot API. Изменения данных пишутся на диск позже, фоновыми
+задачами; время и объём такой записи делятся между обработчиками,
+изменения которых в неё попали, пропорционально числу изменений
+(handler.<имя>.flush_ms и flush_bytes, по одному значению на запись).
+Сводка пишется в лог раз в BOT_METRICS_LOG_INTERVAL секунд и отдаётся
+по HTTP на BOT_METRICS_PORT.
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+import config
+
+logger = logging.getLogger(__name__)
+
+ENABLED = config.METRICS_ENABLED
+
+# Границы корзин гистограмм (для времени - миллисекунды)
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float('inf'))
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """Верхняя граница корзины, в которую попадает q-й процентиль"""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+def percentile(values, q):
+    """q-й процентиль отсортированного списка values (без интерполяции)"""
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+class HandlerStats:
+    """Что успел сделать один вызов обработчика (или одна фоновая запись)"""
+
+    __slots__ = ('name', 'storage_ms', 'bytes', 'api_ms', 'api_calls')
+
+    def __init__(self, name=None):
+        self.name = name
+        self.storage_ms = 0.0
+        self.bytes = 0
+        self.api_ms = 0.0
+        self.api_calls = 0
+
+
+_histograms = {}
+_lock = threading.Lock()
+_current = contextvars.ContextVar('metrics_handler', default=None)
+
+
+def observe(name, value):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(value)
+
+
+def timed(func=None, name=None):
+    """Декоратор обработчика: замеряет время и собирает операции,
+    выполненные за время вызова. Вложенные вызовы (например show_profile
+    внутри button_handler) замеряются отдельно и входят во внешний."""
+    if func is None:
+        return functools.partial(timed, name=name)
+    if not ENABLED:
+        return func
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        nested = _current.get() is not None
+        stats = None
+        if not nested:
+            stats = HandlerStats(name)
+            token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            observe(f'handler.{name}', (time.perf_counter() - started) * 1000)
+            if not nested:
+                _current.reset(token)
+                observe(f'handler.{name}.storage_ms', stats.storage_ms)
+                observe(f'handler.{name}.api_ms', stats.api_ms)
+                observe(f'handler.{name}.api_calls', stats.api_calls)
+    return wrapper
+
+
+def current_handler():
+    """Имя обработчика, который сейчас выполняется, или None"""
+    stats = _current.get()
+    return stats.name if stats is not None else None
+
+
+def count_change(owners):
+    """Запоминает в owners ({имя обработчика: изменений}), что текущий
+    обработчик поставил изменение в очередь на запись"""
+    name = current_handler()
+    if name is not None:
+        owners[name] = owners.get(name, 0) + 1
+
+
+@contextlib.contextmanager
+def flush_scope():
+    """Отдельный учёт для фоновой записи: время и объём операций внутри
+    блока собираются в отдельный HandlerStats, который потом делится
+    между обработчиками через charge()"""
+    stats = HandlerStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def charge(owners, stats):
+    """Делит время и объём записи stats между обработчиками из owners
+    пропорционально числу их изменений"""
+    total = sum(owners.values())
+    for name, count in owners.items():
+        share = count / total
+        observe(f'handler.{name}.flush_ms', stats.storage_ms * share)
+        observe(f'handler.{name}.flush_bytes', stats.bytes * share)
+
+
+def record_storage(op, seconds):
+    """Операция с хранилищем (в пуле потоков), длительность в секундах"""
+    ms = seconds * 1000
+    observe(f'storage.{op}', ms)
+    stats = _current.get()
+    if stats is not None:
+        stats.storage_ms += ms
+
+
+def record_bytes(direction, nbytes):
+    """Объём записанных (direction='write') или прочитанных данных"""
+    if not ENABLED:
+        return
+    observe(f'storage.bytes_{direction}', nbytes)
+    stats = _current.get()
+    if stats is not None:
+        stats.bytes += nbytes
+
+
+def record_api(method, seconds):
+    ms = seconds * 1000
+    observe(f'api.{method}', ms)
+    stats = _current.get()
+    if stats is not None:
+        stats.api_ms += ms
+        stats.api_calls += 1
+
+
+def summary():
+    """Текстовая сводка: по строке на гистограмму"""
+    with _lock:
+        items = sorted(_histograms.items())
+        lines = [
+            f"{name} count={h.count} sum={h.sum:.1f} p50={h.percentile(50):g} "
+            f"p95={h.percentile(95):g} p99={h.percentile(99):g} max={h.max:g}"
+            for name, h in items
+        ]
+    return '\n'.join(lines)
+
+
+def totals():
+    """{имя: (количество, сумма)} по всем гистограммам"""
+    with _lock:
+        return {name: (h.count, h.sum) for name, h in _histograms.items()}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+async def _log_summary(interval):
+    while True:
+        await asyncio.sleep(interval)
+        text = summary()
+        if text:
+            logger.info(f"Метрики:\n{text}")
+
+
+async def _serve_http(reader, writer):
+    try:
+        # Запрос не разбираем: на любой путь отдаём сводку
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        body = (summary() + '\n').encode('utf-8')
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; charset=utf-8\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+class Exporter:
+    """Периодическая сводка в лог и HTTP-эндпоинт со сводкой"""
+
+    def __init__(self, log_interval=60, port=0, listen='127.0.0.1'):
+        self.log_interval = log_interval
+        self.port = port
+        self.listen = listen
+        self._task = None
+        self._server = None
+
+    async def start(self):
+        if not ENABLED:
+            return
+        if self.log_interval > 0:
+            self._task = asyncio.create_task(_log_summary(self.log_interval))
+        if self.port:
+            self._server = await asyncio.start_server(_serve_http, self.listen, self.port)
+            logger.info(f"Метрики доступны на http://{self.listen}:{self.port}/")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if ENABLED:
+            logger.info(f"Метрики:\n{summary()}")
@@ -0,0 +1,316 @@
+"""Перенос данных из users.json, likes.json/likes.log, reviews.json,
+seen.log и activity.log в SQLite (схема storage.py).
+
+Файлы читаются потоково, записи вставляются большими транзакциями,
+индексы создаются после загрузки. Прогресс по каждому файлу сохраняется
+в той же транзакции, что и данные, поэтому прерванный перенос можно
+продолжить с --resume. После переноса количество строк сверяется с
+исходными файлами.
+
+    python migrate.py --data-dir ./data           # в ./data/bot.db
+    python migrate.py --resume
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import config
+import storage
+from reviews_store import normalize_username
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = ' \t\n\r'
+
+_decoder = json.JSONDecoder()
+
+
+class JsonStream:
+    """Потоковое чтение JSON-файла, у которого верхний уровень - массив
+    или объект. Файл целиком в память не загружается."""
+
+    def __init__(self, f):
+        self._f = f
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        chunk = self._f.read(CHUNK_SIZE)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char not in chars or not char:
+            raise ValueError(f"Ожидался один из символов {chars!r}, получен {char!r}")
+        self._pos += 1
+        return char
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # Число на границе блока могло быть прочитано не полностью
+            if end == len(self._buf) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def items(self):
+        """Элементы массива или пары (ключ, значение) объекта"""
+        opening = self._expect('[{')
+        closing = ']' if opening == '[' else '}'
+        if self._peek() == closing:
+            return
+        while True:
+            if opening == '[':
+                yield self._value()
+            else:
+                key = self._value()
+                self._expect(':')
+                yield key, self._value()
+            if self._expect(',' + closing) == closing:
+                return
+
+
+def iter_json(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from JsonStream(f).items()
+
+
+def iter_log(path):
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+# --- Преобразование записей исходных файлов в строки таблиц ---
+
+def profile_rows(profile):
+    yield tuple(profile.get(column) for column in storage.PROFILE_COLUMNS)
+
+
+def legacy_like_rows(item):
+    str_from, liked = item
+    for str_to in liked:
+        yield int(str_from), int(str_to)
+
+
+def log_like_rows(record):
+    yield record['from'], record['to']
+
+
+def review_rows(item):
+    username, texts = item
+    for text in texts:
+        yield normalize_username(username), text
+
+
+def seen_rows(record):
+    yield record['user'], record['seen']
+
+
+def activity_rows(record):
+    yield record['user'], record['t']
+
+
+PROFILE_INSERT = (
+    f"INSERT OR REPLACE INTO profiles ({', '.join(storage.PROFILE_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in storage.PROFILE_COLUMNS)})"
+)
+LIKE_INSERT = "INSERT OR IGNORE INTO likes (from_user_id, to_user_id) VALUES (?, ?)"
+REVIEW_INSERT = "INSERT INTO reviews (target_username, text) VALUES (?, ?)"
+SEEN_INSERT = "INSERT OR IGNORE INTO seen (user_id, seen_user_id) VALUES (?, ?)"
+ACTIVITY_INSERT = (
+    "INSERT INTO activity (user_id, last_active) VALUES (?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET last_active = MAX(last_active, excluded.last_active)"
+)
+
+
+def sources(data_dir):
+    """(имя, итератор записей, преобразование в строки, INSERT)"""
+    return [
+        ('users.json', lambda: iter_json(os.path.join(data_dir, 'users.json')), profile_rows, PROFILE_INSERT),
+        ('likes.json', lambda: iter_json(os.path.join(data_dir, 'likes.json')), legacy_like_rows, LIKE_INSERT),
+        ('likes.log', lambda: iter_log(os.path.join(data_dir, 'likes.log')), log_like_rows, LIKE_INSERT),
+        ('reviews.json', lambda: iter_json(os.path.join(data_dir, 'reviews.json')), review_rows, REVIEW_INSERT),
+        ('seen.log', lambda: iter_log(os.path.join(data_dir, 'seen.log')), seen_rows, SEEN_INSERT),
+        ('activity.log', lambda: iter_log(os.path.join(data_dir, 'activity.log')), activity_rows, ACTIVITY_INSERT),
+    ]
+
+
+def _init_progress(conn):
+    with conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS migration_progress (
+                source TEXT PRIMARY KEY,
+                done INTEGER NOT NULL,
+                finished INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+
+def _progress(conn, source):
+    row = conn.execute(
+        "SELECT done, finished FROM migration_progress WHERE source = ?", (source,)
+    ).fetchone()
+    return row if row else (0, 0)
+
+
+def _save_progress(conn, source, done, finished=0):
+    conn.execute(
+        "INSERT INTO migration_progress (source, done, finished) VALUES (?, ?, ?) "
+        "ON CONFLICT(source) DO UPDATE SET done = excluded.done, finished = excluded.finished",
+        (source, done, finished)
+    )
+
+
+def load_source(conn, name, records, to_rows, insert, batch_size):
+    """Загружает один файл, пропуская уже перенесённые записи"""
+    done, finished = _progress(conn, name)
+    if finished:
+        print(f"{name}: уже перенесён ({done} записей)")
+        return
+    started = time.monotonic()
+    rows = []
+    count = 0
+    for count, record in enumerate(records(), 1):
+        if count <= done:
+            continue
+        rows.extend(to_rows(record))
+        if count % batch_size == 0:
+            # Данные и прогресс фиксируются одной транзакцией
+            with conn:
+                conn.executemany(insert, rows)
+                _save_progress(conn, name, count)
+            rows = []
+            print(f"{name}: {count} записей")
+    with conn:
+        conn.executemany(insert, rows)
+        _save_progress(conn, name, max(count, done), finished=1)
+    print(f"{name}: перенесено {max(count, done)} записей за {time.monotonic() - started:.1f} с")
+
+
+def _missing_pairs(conn, table, columns, pairs):
+    query = f"SELECT 1 FROM {table} WHERE {columns[0]} = ? AND {columns[1]} = ?"
+    return sum(1 for pair in pairs if conn.execute(query, pair).fetchone() is None)
+
+
+def verify(conn, data_dir):
+    """Сверяет перенесённые данные с исходными файлами, возвращает True если всё совпало"""
+    ok = True
+
+    user_ids = set()
+    for profile in iter_json(os.path.join(data_dir, 'users.json')):
+        user_ids.add(profile['user_id'])
+    profiles_count = conn.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+    print(f"profiles: в файле {len(user_ids)}, в базе {profiles_count}")
+    ok &= profiles_count == len(user_ids)
+
+    reviews_expected = sum(len(texts) for _, texts in iter_json(os.path.join(data_dir, 'reviews.json')))
+    reviews_count = conn.execute("SELECT COUNT(*) FROM reviews").fetchone()[0]
+    print(f"reviews: в файле {reviews_expected}, в базе {reviews_count}")
+    ok &= reviews_count == reviews_expected
+
+    # Лайки и просмотры дублируются между файлами, поэтому проверяем
+    # наличие каждой пары, а не количество
+    like_pairs = (
+        pair
+        for source, to_rows in (
+            (iter_json(os.path.join(data_dir, 'likes.json')), legacy_like_rows),
+            (iter_log(os.path.join(data_dir, 'likes.log')), log_like_rows),
+        )
+        for record in source
+        for pair in to_rows(record)
+    )
+    missing_likes = _missing_pairs(conn, 'likes', ('from_user_id', 'to_user_id'), like_pairs)
+    likes_count = conn.execute("SELECT COUNT(*) FROM likes").fetchone()[0]
+    print(f"likes: в базе {likes_count}, не найдено {missing_likes}")
+    ok &= missing_likes == 0
+
+    seen_pairs = (
+        pair for record in iter_log(os.path.join(data_dir, 'seen.log')) for pair in seen_rows(record)
+    )
+    missing_seen = _missing_pairs(conn, 'seen', ('user_id', 'seen_user_id'), seen_pairs)
+    print(f"seen: не найдено {missing_seen}")
+    ok &= missing_seen == 0
+
+    return ok
+
+
+def migrate(data_dir, db_file, batch_size=50000, resume=False):
+    target = storage.Storage(db_file)
+    conn = target.connection()
+    _init_progress(conn)
+    has_progress = conn.execute("SELECT COUNT(*) FROM migration_progress").fetchone()[0]
+    if has_progress and not resume:
+        print("Перенос уже начинался. Продолжите с --resume или удалите таблицы из базы.")
+        return False
+    if not resume:
+        for table in ('profiles', 'likes', 'reviews', 'seen', 'activity'):
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+            ).fetchone()
+            if exists and conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                print(f"Таблица {table} не пуста, перенос в непустую базу не выполняется.")
+                return False
+
+    # Индексы создаются после загрузки, чтобы не перестраивать их на каждой вставке
+    target.create_schema(indexes=False)
+    for name, records, to_rows, insert in sources(data_dir):
+        load_source(conn, name, records, to_rows, insert, batch_size)
+
+    print("Создание индексов...")
+    target.create_indexes()
+    with conn:
+        conn.execute("ANALYZE")
+
+    ok = verify(conn, data_dir)
+    print("Проверка пройдена." if ok else "Проверка НЕ пройдена!")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перенос JSON-данных бота в SQLite")
+    parser.add_argument('--data-dir', default=config.DATA_DIR, help="каталог с users.json и остальными файлами")
+    parser.add_argument('--db', help="файл базы SQLite; по умолчанию bot.db в --data-dir, где его ищет бот")
+    parser.add_argument('--batch-size', type=int, default=50000, help="записей на транзакцию")
+    parser.add_argument('--resume', action='store_true', help="продолжить прерванный перенос")
+    args = parser.parse_args()
+    db = args.db or os.path.join(args.data_dir, 'bot.db')
+    ok = migrate(args.data_dir, db, args.batch_size, args.resume)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+def _seconds(delay):
+    # В новых версиях PTB retry_after - timedelta
+    return delay.total_seconds() if hasattr(delay, 'total_seconds') else float(delay)
+
+
+class Outbox:
+    """Очередь исходящих сообщений.
+
+    Обработчик кладёт сообщение в очередь и не ждёт отправки. Несколько
+    воркеров отправляют независимые сообщения параллельно, соблюдая общий
+    лимит сообщений в секунду и интервал между сообщениями в один чат.
+    На RetryAfter (429) отправка приостанавливается на указанное время,
+    на сетевые ошибки - повторяется с растущей задержкой.
+    """
+
+    def __init__(self, workers=8, rate=25, chat_interval=1.0, max_retries=5,
+                 backoff=0.5, max_size=10000):
+        self.workers = workers
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.bot = None
+        self._queue = asyncio.Queue(max_size)
+        self._tasks = []
+        self._global_next = 0.0
+        self._chat_next = {}
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def submit(self, method, **kwargs):
+        """Ставит вызов метода бота (например 'send_message') в очередь.
+        Среди аргументов должен быть chat_id.
+
+        Возвращает Future с результатом, ждать его не обязательно.
+        """
+        chat_id = kwargs['chat_id']
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((method, kwargs, future))
+        except asyncio.QueueFull:
+            logger.error(f"Очередь отправки переполнена, сообщение в чат {chat_id} отброшено")
+            future.cancel()
+        return future
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self.submit('send_message', chat_id=chat_id, text=text, **kwargs)
+
+    def start(self, bot):
+        self.bot = bot
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10):
+        """Дожидается отправки накопившихся сообщений (не дольше timeout)"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено сообщений: {self._queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _wait_slot(self, chat_id):
+        # Слоты резервируются без await между чтением и записью,
+        # поэтому воркеры не займут один и тот же слот
+        now = time.monotonic()
+        start = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = start + self.chat_interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+        now = time.monotonic()
+        start = max(now, self._global_next)
+        self._global_next = start + 1 / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def _forget_idle_chats(self):
+        now = time.monotonic()
+        if len(self._chat_next) > 10000:
+            self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+
+    async def _send(self, chat_id, method, kwargs):
+        attempt = 0
+        while True:
+            await self._wait_slot(chat_id)
+            try:
+                return await getattr(self.bot, method)(**kwargs)
+            except RetryAfter as e:
+                # Лимит Telegram общий для бота: приостанавливаем все отправки
+                if attempt >= self.max_retries:
+                    raise
+                delay = _seconds(e.retry_after)
+                logger.warning(f"Лимит Telegram, пауза {delay} с")
+                self._global_next = max(self._global_next, time.monotonic() + delay)
+            except (BadRequest, Forbidden):
+                # Повтор не поможет: чат недоступен или запрос некорректен
+                raise
+            except NetworkError:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    async def _run(self):
+        while True:
+            method, kwargs, future = await self._queue.get()
+            chat_id = kwargs['chat_id']
+            try:
+                result = await self._send(chat_id, method, kwargs)
+                if not future.done():
+                    future.set_result(result)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+                if not future.done():
+                    future.set_exception(e)
+                    # Исключение уже в логе, не ругаемся на неполученный результат
+                    future.exception()
+            finally:
+                self._queue.task_done()
+                self._forget_idle_chats()
@@ -0,0 +1,353 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Все блокирующие операции с файлами и базой выполняются в этих потоках,
+# чтобы медленная запись не задерживала обработку чужих обновлений
+_executor = ThreadPoolExecutor(max_workers=config.STORAGE_WORKERS, thread_name_prefix='storage')
+_limiter = None
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Выполняет блокирующую функцию в пуле потоков хранилища.
+
+    Одновременно ожидающих операций не больше STORAGE_MAX_PENDING,
+    остальные ждут своей очереди, не занимая потоки.
+    """
+    global _limiter
+    if _limiter is None:
+        _limiter = asyncio.Semaphore(config.STORAGE_MAX_PENDING)
+    loop = asyncio.get_running_loop()
+    async with _limiter:
+        if not metrics.ENABLED:
+            return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+        # Контекст копируется в поток, чтобы объём записанных данных
+        # попал в замеры обработчика, который вызвал операцию
+        context = contextvars.copy_context()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(_executor, context.run, partial(func, *args, **kwargs))
+        finally:
+            name = getattr(func, 'func', func).__name__
+            metrics.record_storage(name, time.perf_counter() - started)
+
+
+async def run_flush(owners, func, *args):
+    """run_blocking для фоновой записи: её время и объём делятся между
+    обработчиками из owners, чьи изменения она записывает"""
+    if not metrics.ENABLED or not owners:
+        return await run_blocking(func, *args)
+    with metrics.flush_scope() as stats:
+        result = await run_blocking(func, *args)
+    metrics.charge(owners, stats)
+    return result
+
+
+def merge_owners(owners, other):
+    for name, count in other.items():
+        owners[name] = owners.get(name, 0) + count
+
+
+def load_json(filename, default):
+    if os.path.exists(filename):
+        with open(filename, 'r', encoding='utf-8') as f:
+            metrics.record_bytes('read', os.fstat(f.fileno()).st_size)
+            return json.load(f)
+    return default
+
+
+def atomic_write_json(filename, data):
+    """Атомарная запись JSON: пишем во временный файл и переименовываем"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+            metrics.record_bytes('write', os.fstat(f.fileno()).st_size)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class JsonFileBackend:
+    """Хранение данных WriteBehindStore целиком в одном JSON-файле"""
+
+    def __init__(self, path, default):
+        self.path = path
+        self.default = default
+
+    def __repr__(self):
+        return self.path
+
+    def load(self):
+        return load_json(self.path, self.default)
+
+    def prepare(self, store, dirty):
+        """Берёт снимок данных и возвращает функцию записи для потока"""
+        return partial(atomic_write_json, self.path, store._snapshot())
+
+
+class WriteBehindStore:
+    """Хранилище в памяти с отложенной фоновой записью на диск.
+
+    Наследники реализуют _load(data), _snapshot() (все данные) и
+    _items(keys) (только изменённые записи, для построчных хранилищ).
+    Изменения помечаются через mark_dirty(); фоновая задача сбрасывает их
+    раз в flush_interval секунд или сразу, как только накопится
+    flush_threshold изменений.
+
+    backend - путь к JSON-файлу или объект с методами load() и
+    prepare(store, dirty), например JsonFileBackend.
+    """
+
+    default = None
+
+    def __init__(self, backend, flush_interval=5.0, flush_threshold=100):
+        if isinstance(backend, str):
+            backend = JsonFileBackend(backend, self.default)
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._dirty = set()
+        # Обработчики, чьи изменения ждут записи: {имя: изменений}
+        self._owners = {}
+        self._wakeup = None
+        self._task = None
+        self._closing = False
+
+    def load(self):
+        self._load(self.backend.load())
+        self._dirty.clear()
+
+    def _load(self, data):
+        raise NotImplementedError
+
+    def _snapshot(self):
+        raise NotImplementedError
+
+    def _items(self, keys):
+        raise NotImplementedError
+
+    @property
+    def dirty(self):
+        return bool(self._dirty)
+
+    def mark_dirty(self, key):
+        self._dirty.add(key)
+        if metrics.ENABLED:
+            metrics.count_change(self._owners)
+        if len(self._dirty) >= self.flush_threshold and self._wakeup is not None:
+            self._wakeup.set()
+
+    def flush(self):
+        """Синхронная запись (при остановке и в утилитах)"""
+        if not self._dirty:
+            return
+        self.backend.prepare(self, self._dirty)()
+        self._dirty.clear()
+        self._owners = {}
+
+    async def flush_async(self):
+        if not self._dirty:
+            return
+        # Снимок берём в цикле событий, а сериализуем и пишем в потоке
+        dirty, self._dirty = self._dirty, set()
+        owners, self._owners = self._owners, {}
+        write = self.backend.prepare(self, dirty)
+        try:
+            await run_flush(owners, write)
+        except Exception:
+            self._dirty |= dirty
+            merge_owners(self._owners, owners)
+            raise
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush_async()
+            except Exception as e:
+                logger.error(f"Ошибка записи {self.backend!r}: {e}")
+
+    def start(self):
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Не отменяем задачу посреди записи, а даём ей завершить цикл
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        self.flush()
+
+
+class AppendLog:
+    """Журнал событий: по одной JSON-записи на строку, только дозапись"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Недописанная последняя строка после аварийной остановки
+                    logger.warning(f"Пропущена повреждённая запись в {self.path}")
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        data = ''.join(
+            json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+            for record in records
+        )
+        self._file.write(data)
+        self._file.flush()
+        if metrics.ENABLED:
+            metrics.record_bytes('write', len(data.encode('utf-8')))
+
+    def rewrite(self, records):
+        """Атомарно заменяет журнал (сжатие)"""
+        self.close()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.log', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BufferedLog:
+    """Журнал, дозапись в который не блокирует цикл событий.
+
+    append() только кладёт запись в буфер; фоновая задача пишет
+    накопленные записи одной пачкой в пуле потоков хранилища. Пока задача
+    не запущена (утилиты, тесты), запись выполняется сразу. Если запись
+    не удалась, записи возвращаются в начало буфера и через retry_interval
+    секунд пишутся снова.
+    """
+
+    def __init__(self, log, retry_interval=1.0):
+        self.log = AppendLog(log) if isinstance(log, str) else log
+        self.retry_interval = retry_interval
+        self._buffer = []
+        self._owners = {}
+        self._wakeup = None
+        self._task = None
+        self._closing = False
+
+    def exists(self):
+        return self.log.exists()
+
+    def replay(self):
+        return self.log.replay()
+
+    def rewrite(self, records):
+        self.log.rewrite(records)
+
+    def append(self, record):
+        if self._task is None:
+            self.log.append(record)
+            return
+        self._buffer.append(record)
+        if metrics.ENABLED:
+            metrics.count_change(self._owners)
+        self._wakeup.set()
+
+    async def _flush(self):
+        """Пишет буфер; при ошибке возвращает записи в начало буфера"""
+        records, self._buffer = self._buffer, []
+        owners, self._owners = self._owners, {}
+        try:
+            await run_flush(owners, self.log.append_many, records)
+        except Exception as e:
+            logger.error(f"Ошибка записи журнала, повтор через {self.retry_interval} с: {e}")
+            self._buffer[:0] = records
+            merge_owners(self._owners, owners)
+            return False
+        return True
+
+    async def _run(self):
+        failed = False
+        while True:
+            if failed:
+                # Повторяем по таймеру, не дожидаясь новых записей
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.retry_interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self._wakeup.wait()
+            self._wakeup.clear()
+            failed = bool(self._buffer) and not await self._flush()
+            if self._closing:
+                return
+
+    def start(self):
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        if self._buffer:
+            # Последняя попытка при остановке: при ошибке исключение уходит
+            # вызывающему, а записи остаются в буфере
+            self.log.append_many(self._buffer)
+            self._buffer = []
+            self._owners = {}
+
+    def close(self):
+        self.log.close()
@@ -0,0 +1,344 @@
+"""Пакетное построение очередей поиска для всех анкет.
+
+Анкеты раскладываются в столбцы numpy (код пола, возраст, код искомого
+пола, age_min, age_max, фото) и сортируются по (пол, возраст). Анкеты с
+одинаковыми параметрами поиска обрабатываются вместе: односторонний
+фильтр - это срезы по полу и диапазону возрастов, взаимность проверяется
+булевой маской по срезу, оценка считается так же, как в ranking.Ranker.
+Для каждого пользователя в таблицу recommendations (bot.db) пишется
+RANK_QUEUE_SIZE лучших кандидатов без лайкнутых и пропущенных; search()
+в main.py берёт готовую очередь, пока параметры поиска не менялись.
+
+    python precompute.py                        # данные из BOT_DATA_DIR / BOT_STORAGE
+    python precompute.py --chunk-size 5000      # по 5000 очередей на транзакцию
+
+Нужен numpy (pip install numpy); боту он не нужен.
+"""
+import argparse
+import math
+import os
+import sys
+import time
+from array import array
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import config
+import storage
+from matching import ANY_GENDER
+from persistence import AppendLog, load_json
+from ranking import REVIEWS_HALF_SCORE, Ranker
+from reviews_store import normalize_username
+
+# Коды в столбцах: нет значения и "любой" пол
+MISSING = -2
+ANY = -1
+
+
+class Columns:
+    """Столбцы анкет, отсортированные по (код пола, возраст, user_id).
+
+    Анкеты читаются за один проход и сразу раскладываются в массивы,
+    словари анкет не хранятся. Пол и искомый пол хранятся дважды: номер
+    исходной строки в names (из них собираются параметры поиска для
+    сверки в search()) и код для подбора без учёта регистра.
+    """
+
+    FIELDS = ('user_id', 'gender_name', 'gender', 'age', 'target_name', 'target',
+              'age_min', 'age_max', 'photo', 'reviews', 'last_active')
+
+    def __init__(self, profiles, review_count, last_active):
+        names = {None: 0}
+
+        def name(value):
+            return names.setdefault(value or None, len(names))
+
+        def number(profile, field, default):
+            value = profile.get(field)
+            return default if value is None else value
+
+        user_id, age, age_min, age_max = array('q'), array('h'), array('h'), array('h')
+        gender_name, target_name = array('h'), array('h')
+        photo, reviews, active = array('b'), array('d'), array('d')
+        for profile in profiles:
+            user_id.append(profile['user_id'])
+            gender_name.append(name(profile.get('gender')))
+            target_name.append(name(profile.get('target_gender')))
+            # Без пола или возраста анкета не кандидат, без предпочтений
+            # никого не принимает (как в MatchIndex)
+            age.append(number(profile, 'age', -1))
+            age_min.append(number(profile, 'age_min', 1))
+            age_max.append(number(profile, 'age_max', 0))
+            photo.append(bool(profile.get('photo_id')))
+            reviews.append(review_count(profile))
+            active.append(last_active.get(profile['user_id'], math.nan))
+
+        self.names = list(names)
+        codes = {}
+        lookup = [MISSING]
+        for value in self.names[1:]:
+            value = value.lower()
+            lookup.append(ANY if value == ANY_GENDER else codes.setdefault(value, len(codes)))
+        self.codes = np.array(lookup, dtype=np.int16)
+        self.gender_codes = sorted(codes.values())
+
+        self.user_id = np.array(user_id, dtype=np.int64)
+        self.gender_name = np.array(gender_name, dtype=np.int16)
+        self.gender = self.codes[self.gender_name]
+        self.age = np.array(age, dtype=np.int16)
+        self.target_name = np.array(target_name, dtype=np.int16)
+        self.target = self.codes[self.target_name]
+        self.age_min = np.array(age_min, dtype=np.int16)
+        self.age_max = np.array(age_max, dtype=np.int16)
+        self.photo = np.array(photo, dtype=bool)
+        self.reviews = np.array(reviews, dtype=np.float64)
+        self.last_active = np.array(active, dtype=np.float64)
+
+        order = np.lexsort((self.user_id, self.age, self.gender))
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field)[order])
+        self._bounds = {
+            gender: (int(np.searchsorted(self.gender, gender, 'left')),
+                     int(np.searchsorted(self.gender, gender, 'right')))
+            for gender in self.gender_codes
+        }
+
+    def __len__(self):
+        return len(self.user_id)
+
+    def ranges(self, target, age_min, age_max):
+        """Границы [start, stop) анкет с полом target (или любым) и
+        возрастом в диапазоне - по одной на пол"""
+        genders = self.gender_codes if target == ANY else [target]
+        ranges = []
+        for gender in genders:
+            lo, hi = self._bounds.get(gender, (0, 0))
+            ages = self.age[lo:hi]
+            ranges.append((lo + int(np.searchsorted(ages, age_min, 'left')),
+                           lo + int(np.searchsorted(ages, age_max, 'right'))))
+        return ranges
+
+
+class Rated:
+    """Уже оценённые анкеты (лайкнутые и пропущенные): пары (кто, кого)
+    в двух массивах int64, отсортированных по тому, кто оценивал"""
+
+    def __init__(self, pairs):
+        raters, rated = array('q'), array('q')
+        for rater, user_id in pairs:
+            raters.append(rater)
+            rated.append(user_id)
+        raters = np.array(raters, dtype=np.int64)
+        order = np.argsort(raters, kind='stable')
+        self.raters = raters[order]
+        self.rated = np.array(rated, dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.raters)
+
+    def lookup(self, user_ids):
+        """Для массива user_ids: (число оценённых каждым, номер в user_ids
+        для каждой пары, user_id оценённой анкеты для каждой пары)"""
+        lo = np.searchsorted(self.raters, user_ids, 'left')
+        lengths = np.searchsorted(self.raters, user_ids, 'right') - lo
+        rows = np.repeat(np.arange(len(user_ids)), lengths)
+        # Позиции пар каждого пользователя: lo, lo + 1, ... подряд
+        offsets = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return lengths, rows, self.rated[np.repeat(lo, lengths) + offsets]
+
+
+def static_scores(columns, ranker, now):
+    """Часть оценки, не зависящая от того, кто ищет: фото, отзывы, активность"""
+    scores = ranker.photo_weight * columns.photo
+    scores = scores + ranker.reviews_weight * columns.reviews / (columns.reviews + REVIEWS_HALF_SCORE)
+    idle = np.maximum(now - columns.last_active, 0)
+    recency = ranker.recency_weight * np.exp(-math.log(2) * idle / ranker.recency_half_life)
+    return scores + np.nan_to_num(recency, nan=0.0)
+
+
+def build(columns, ranker, rated, size, two_sided=True, chunk_size=0, now=None):
+    """Очереди кандидатов: отдаёт списки (user_id, параметры, кандидаты
+    в формате storage.unpack_ids) частями примерно по chunk_size (0 - одной частью).
+
+    rated - Rated с лайкнутыми и пропущенными анкетами, их не показываем.
+    """
+    if np is None:
+        raise RuntimeError("Для пакетного построения очередей нужен numpy: pip install numpy")
+    now = now if now is not None else time.time()
+    static = static_scores(columns, ranker, now)
+
+    # Пользователи с одинаковыми параметрами поиска получают общий список
+    searchers = np.flatnonzero(
+        (columns.gender != MISSING) & (columns.age >= 0) & (columns.target != MISSING)
+        & (columns.age_min <= columns.age_max)
+    )
+    # Группы по исходным строкам пола, чтобы параметры поиска совпали с анкетой
+    keys = np.stack([columns.gender_name, columns.age, columns.target_name, columns.age_min, columns.age_max], axis=1)
+    groups, inverse = np.unique(keys[searchers], axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    members = np.split(searchers[np.argsort(inverse, kind='stable')], np.cumsum(np.bincount(inverse))[:-1])
+
+    chunk = []
+    for (gender_name, age, target_name, age_min, age_max), group in zip(groups.tolist(), members):
+        gender = int(columns.codes[gender_name])
+        target = int(columns.codes[target_name])
+        parts = []
+        for start, stop in columns.ranges(target, age_min, age_max):
+            if not two_sided:
+                parts.append(np.arange(start, stop))
+                continue
+            # Срезы - это представления без копирования, маска считается по ним
+            targets = columns.target[start:stop]
+            accepts = (targets == gender) | (targets == ANY)
+            accepts &= (columns.age_min[start:stop] <= age) & (columns.age_max[start:stop] >= age)
+            parts.append(start + np.flatnonzero(accepts))
+        idx = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+        middle = (age_min + age_max) / 2
+        half_range = max((age_max - age_min) / 2, 1)
+        scores = static[idx] + ranker.age_weight * (
+            1 - np.minimum(np.abs(columns.age[idx] - middle) / half_range, 1)
+        )
+
+        group_ids = columns.user_id[group]
+        lengths, rows, ids = rated.lookup(group_ids)
+        # Запас на исключения: сам пользователь и уже оценённые анкеты
+        need = min(len(idx), size + 1 + int(lengths.max()))
+        if need < len(idx):
+            # argpartition оставляет произвольную часть равных need-й оценке,
+            # поэтому берём всех с оценкой не ниже неё и обрезаем после сортировки
+            kth = scores[np.argpartition(-scores, need - 1)[need - 1]]
+            top = np.flatnonzero(scores >= kth)
+        else:
+            top = np.arange(len(idx))
+        # Как в Ranker.top: по убыванию оценки, при равенстве - меньший user_id
+        top = top[np.lexsort((columns.user_id[idx[top]], -scores[top]))][:need]
+        ranked = columns.user_id[idx[top]]
+
+        # Маска "показывать" размером (участники группы) x (кандидаты):
+        # убираем самого пользователя и оценённые им анкеты
+        keep = ranked[None, :] != group_ids[:, None]
+        if len(ids) and len(ranked):
+            order = np.argsort(ranked)
+            pos = np.minimum(np.searchsorted(ranked, ids, sorter=order), len(ranked) - 1)
+            found = ranked[order[pos]] == ids
+            keep[rows[found], order[pos[found]]] = False
+        keep &= np.cumsum(keep, axis=1) <= size
+
+        # Очереди сразу упаковываются в байты (формат storage.unpack_ids),
+        # без промежуточных списков Python
+        packed = np.broadcast_to(ranked, keep.shape)[keep].astype('<i8').tobytes()
+        bounds = (np.cumsum(keep.sum(axis=1)) * 8).tolist()
+        params = [columns.names[gender_name], age, columns.names[target_name], age_min, age_max]
+        start = 0
+        for user_id, stop in zip(group_ids.tolist(), bounds):
+            chunk.append((user_id, params, packed[start:stop]))
+            start = stop
+        # Часть отдаётся целыми группами, поэтому может быть чуть больше
+        # chunk_size. Части ограничивают транзакцию записи и число готовых
+        # очередей в памяти; столбцы занимают десятки байт на анкету
+        if chunk_size and len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def read_pairs(log, key, value):
+    """Пары (key, value) из журнала с интерфейсом AppendLog"""
+    for record in log.replay():
+        yield record[key], record[value]
+
+
+def iter_json(path):
+    """Записи из JSON-списка; сам список освобождается после перебора"""
+    yield from load_json(path, [])
+
+
+def load_data(data_dir, backend):
+    """Анкеты, признаки для оценки и уже оценённые анкеты из данных бота.
+
+    Хранилища бота не создаются: анкеты отдаются итератором для Columns,
+    от отзывов нужно только их число, а лайки и просмотры читаются сразу
+    в массивы Rated. Журналы только читаются (без сжатия), поэтому задачу
+    можно запускать, пока бот работает.
+    """
+    if backend == 'sqlite':
+        source = storage.Storage(os.path.join(data_dir, 'bot.db'))
+        profiles = source.iter_profiles()
+        review_counts = source.count_reviews()
+        likes_log = storage.likes_log(source)
+        seen_log = storage.seen_log(source)
+        activity_log = storage.activity_log(source)
+    else:
+        profiles = iter_json(os.path.join(data_dir, 'users.json'))
+        review_counts = (
+            (username, len(texts))
+            for username, texts in load_json(os.path.join(data_dir, 'reviews.json'), {}).items()
+        )
+        likes_log = AppendLog(os.path.join(data_dir, 'likes.log'))
+        seen_log = AppendLog(os.path.join(data_dir, 'seen.log'))
+        activity_log = AppendLog(os.path.join(data_dir, 'activity.log'))
+    reviews = {}
+    for username, count in review_counts:
+        key = normalize_username(username)
+        reviews[key] = reviews.get(key, 0) + count
+    # Старый likes.json бот переносит в журнал при первом запуске
+    rated = Rated(chain(read_pairs(likes_log, 'from', 'to'), read_pairs(seen_log, 'user', 'seen')))
+    last_active = {}
+    for record in activity_log.replay():
+        last_active[record['user']] = max(record['t'], last_active.get(record['user'], 0))
+
+    def review_count(profile):
+        username = profile.get('username')
+        return reviews.get(normalize_username(username), 0) if username else 0
+
+    return profiles, review_count, last_active, rated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетное построение очередей поиска")
+    parser.add_argument('--data-dir', default=config.DATA_DIR, help="каталог с данными бота")
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default=config.STORAGE_BACKEND)
+    parser.add_argument('--db', help="куда записать очереди; по умолчанию bot.db в --data-dir, где их ищет бот")
+    parser.add_argument('--size', type=int, default=config.RANK_QUEUE_SIZE, help="кандидатов на пользователя")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="пользователей на транзакцию; 0 - все сразу")
+    args = parser.parse_args()
+
+    if np is None:
+        sys.exit("Для precompute.py нужен numpy: pip install numpy")
+
+    started = time.monotonic()
+    profiles, review_count, last_active, rated = load_data(args.data_dir, args.storage)
+    columns = Columns(profiles, review_count, last_active)
+    loaded = time.monotonic()
+    print(f"Загружено {len(columns)} анкет за {loaded - started:.1f} с")
+
+    ranker = Ranker(
+        age_weight=config.RANK_AGE_WEIGHT,
+        photo_weight=config.RANK_PHOTO_WEIGHT,
+        reviews_weight=config.RANK_REVIEWS_WEIGHT,
+        recency_weight=config.RANK_RECENCY_WEIGHT,
+        recency_half_life=config.RANK_RECENCY_HALF_LIFE_HOURS * 3600,
+    )
+    target = storage.Storage(args.db or os.path.join(args.data_dir, 'bot.db'))
+    target.create_schema()
+    built_at = int(time.time())
+    count = 0
+    for chunk in build(columns, ranker, rated, args.size, config.SEARCH_TWO_SIDED, args.chunk_size):
+        target.save_recommendations(
+            (user_id, params, candidates, built_at) for user_id, params, candidates in chunk
+        )
+        count += len(chunk)
+        print(f"Построено очередей: {count}")
+    # Очереди прошлых построений (например, удалённых анкет) больше не нужны
+    target.delete_recommendations_before(built_at)
+    print(f"Готово: {count} очередей за {time.monotonic() - loaded:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
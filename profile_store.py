@@ -0,0 +1,92 @@
+from persistence import WriteBehindStore
+
+# Поля анкеты, которые сохраняются в users.json
+PROFILE_FIELDS = (
+    'username',
+    'gender',
+    'age',
+    'about',
+    'target_gender',
+    'age_min',
+    'age_max',
+    'photo_id',
+)
+
+
+class ProfileStore(WriteBehindStore):
+    """Анкеты пользователей в памяти, ключ - user_id.
+
+    Файл читается один раз при запуске, изменения записываются в фоне.
+    Возвращаемые словари нельзя изменять напрямую - только через update().
+    """
+
+    default = []
+
+    def __init__(self, backend, **kwargs):
+        super().__init__(backend, **kwargs)
+        self._profiles = {}
+        self._by_username = {}
+        self._versions = {}
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """callback(profile) вызывается после каждого изменения анкеты"""
+        self._listeners.append(callback)
+
+    def _load(self, data):
+        self._profiles = {}
+        self._by_username = {}
+        for record in data:
+            # В старых users.json встречаются лишние ключи (например,
+            # search_results) - оставляем только поля анкеты
+            profile = {field: record[field] for field in PROFILE_FIELDS if field in record}
+            profile['user_id'] = record['user_id']
+            self._put(record['user_id'], profile)
+
+    def _snapshot(self):
+        return list(self._profiles.values())
+
+    def _items(self, keys):
+        return {user_id: self._profiles.get(user_id) for user_id in keys}
+
+    def _put(self, user_id, profile):
+        old = self._profiles.get(user_id)
+        if old is not None and old.get('username'):
+            self._by_username.pop(old['username'].lower(), None)
+        self._profiles[user_id] = profile
+        if profile.get('username'):
+            self._by_username[profile['username'].lower()] = user_id
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def __contains__(self, user_id):
+        return user_id in self._profiles
+
+    def get(self, user_id):
+        return self._profiles.get(user_id)
+
+    def find_by_username(self, username):
+        user_id = self._by_username.get(username.lstrip('@').lower())
+        if user_id is None:
+            return None
+        return self._profiles.get(user_id)
+
+    def version(self, user_id):
+        """Номер версии анкеты, растёт при каждом изменении"""
+        return self._versions.get(user_id, 0)
+
+    def all(self):
+        return list(self._profiles.values())
+
+    def update(self, user_id, fields):
+        """Создаёт или обновляет анкету, возвращает новую версию"""
+        old = self._profiles.get(user_id, {})
+        profile = {**old, **fields, 'user_id': user_id}
+        # Словарь заменяется целиком, поэтому уже выданные ссылки не меняются
+        self._put(user_id, profile)
+        self._versions[user_id] = self._versions.get(user_id, 0) + 1
+        self.mark_dirty(user_id)
+        for callback in self._listeners:
+            callback(profile)
+        return profile
@@ -0,0 +1,98 @@
+import heapq
+import math
+import time
+
+# Сколько отзывов дают половину максимального балла за отзывы
+REVIEWS_HALF_SCORE = 3
+
+
+class Ranker:
+    """Оценка кандидатов для поиска: взвешенная сумма признаков от 0 до 1.
+
+    - возраст: близость к середине искомого диапазона;
+    - фото: есть ли фото в анкете;
+    - отзывы: число отзывов, с насыщением;
+    - активность: экспоненциальное затухание с периодом полураспада
+      recency_half_life секунд от последней активности.
+    """
+
+    def __init__(self, age_weight=1.0, photo_weight=0.5, reviews_weight=0.3,
+                 recency_weight=1.0, recency_half_life=3 * 24 * 3600):
+        self.age_weight = age_weight
+        self.photo_weight = photo_weight
+        self.reviews_weight = reviews_weight
+        self.recency_weight = recency_weight
+        self.recency_half_life = recency_half_life
+
+    @property
+    def max_bonus(self):
+        """Наибольшая сумма признаков, кроме возраста"""
+        return self.photo_weight + self.reviews_weight + self.recency_weight
+
+    def age_score(self, searcher, age):
+        middle = (searcher['age_min'] + searcher['age_max']) / 2
+        half_range = max((searcher['age_max'] - searcher['age_min']) / 2, 1)
+        return self.age_weight * (1 - min(abs(age - middle) / half_range, 1))
+
+    def score(self, searcher, profile, review_count, last_active, now):
+        """searcher - параметры поиска (поля SEARCH_FIELDS)"""
+        return self.age_score(searcher, profile['age']) + self.bonus(profile, review_count, last_active, now)
+
+    def bonus(self, profile, review_count, last_active, now):
+        """Оценка без возраста: фото, отзывы и активность"""
+        score = 0.0
+        if profile.get('photo_id'):
+            score += self.photo_weight
+        if review_count:
+            score += self.reviews_weight * review_count / (review_count + REVIEWS_HALF_SCORE)
+        if last_active is not None:
+            idle = max(now - last_active, 0)
+            score += self.recency_weight * math.exp(-math.log(2) * idle / self.recency_half_life)
+        return score
+
+    def top(self, searcher, candidates, k, review_count, last_active, now=None):
+        """user_id k лучших анкет из candidates, от лучшей к худшей.
+
+        review_count(profile) и last_active(user_id) - источники признаков.
+        Отбор через кучу размера k, весь список кандидатов не сортируется.
+        """
+        now = now if now is not None else time.time()
+        scored = (
+            (self.score(searcher, profile, review_count(profile), last_active(profile['user_id']), now),
+             -profile['user_id'])
+            for profile in candidates
+        )
+        # При равной оценке выше анкета с меньшим user_id - порядок детерминирован
+        return [-neg_id for _, neg_id in heapq.nlargest(k, scored)]
+
+    def top_by_age(self, searcher, groups, k, review_count, last_active, limit=0, now=None):
+        """То же, что top, но кандидаты приходят группами (возраст, анкеты)
+        от середины искомого диапазона к краям (MatchIndex.iter_match_by_age).
+
+        Оценка за возраст от группы к группе только падает, а остальные
+        признаки дают не больше max_bonus, поэтому перебор останавливается,
+        как только анкета следующей группы уже не может войти в k лучших.
+        limit (0 - без ограничения) - сколько анкет оценить самое большее:
+        тогда результат - лучшие из ближайших к середине по возрасту.
+        """
+        now = now if now is not None else time.time()
+        # Куча k лучших (оценка, -user_id), наверху худшая из них
+        heap = []
+        scored = 0
+        for age, group in groups:
+            age_score = self.age_score(searcher, age)
+            if len(heap) == k and age_score + self.max_bonus < heap[0][0]:
+                break
+            for profile in group:
+                item = (age_score + self.bonus(profile, review_count(profile), last_active(profile['user_id']), now),
+                        -profile['user_id'])
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+                scored += 1
+                if scored == limit:
+                    break
+            if limit and scored >= limit:
+                break
+        return [-neg_id for _, neg_id in sorted(heap, reverse=True)]
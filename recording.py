@@ -0,0 +1,190 @@
+"""Запись входящих обновлений для replay.py.
+
+Каждое обновление пишется одной строкой JSONL: {"t": секунды от начала
+записи, "u": обновление}. Идентификаторы пользователей, username, имена,
+file_id и свободный текст заменяются псевдонимами. Кнопки меню, команды,
+возраст и диапазоны возрастов сохраняются как есть, иначе при
+воспроизведении обработчики пойдут другим путём.
+
+Псевдонимы вычисляются HMAC с ключом BOT_RECORD_KEY, поэтому тем же
+ключом можно обезличить копию данных (anonymize_data_dir), и лайки и
+анкеты из записи совпадут с данными.
+"""
+import hmac
+import json
+import os
+import re
+import secrets
+import time
+
+from persistence import AppendLog, BufferedLog, atomic_write_json, load_json
+from reviews_store import normalize_username
+
+# Тексты, от которых зависит ход диалога (в нижнем регистре)
+CONTROL_TEXTS = {
+    'создать/обновить анкету', 'редактировать профиль', 'оставить отзыв',
+    'посмотреть отзывы', 'искать собеседника',
+    'мужской', 'женский', 'другой', 'любой',
+    'пол', 'возраст', 'о себе', 'искомый пол', 'возрастной диапазон', 'фото', 'отмена',
+}
+CONTROL_PATTERN = re.compile(r'^(/\w+|\d{1,3}|\d{1,3}\s*-\s*\d{1,3})$')
+CALLBACK_PATTERN = re.compile(r'^(\w+)_(\d+)$')
+
+# Поля объектов Telegram с личными данными
+NAME_FIELDS = {
+    'first_name', 'last_name', 'title', 'bio',
+    # Пересланные сообщения: имя скрытого отправителя и подпись автора
+    'sender_user_name', 'forward_sender_name', 'author_signature', 'forward_signature',
+}
+DROPPED_FIELDS = {'phone_number', 'contact', 'location', 'venue'}
+# Ключи, под которыми лежат пользователи и чаты (id чата лички совпадает с id пользователя)
+ID_PARENTS = {
+    'from', 'chat', 'user', 'sender_chat', 'sender_user', 'forward_from', 'forward_from_chat',
+    'via_bot', 'new_chat_members', 'left_chat_member',
+}
+
+
+def is_user(data):
+    """Похож ли словарь на объект User, где бы он ни лежал"""
+    return 'is_bot' in data or 'first_name' in data
+
+
+class Anonymizer:
+    """Устойчивые псевдонимы: одно и то же значение при одном ключе
+    всегда превращается в один и тот же псевдоним"""
+
+    def __init__(self, key):
+        self.key = key.encode('utf-8')
+
+    def _digest(self, value):
+        return hmac.new(self.key, str(value).encode('utf-8'), 'sha256').hexdigest()
+
+    def user_id(self, user_id):
+        return int(self._digest(user_id)[:12], 16)
+
+    def username(self, username):
+        return 'u' + self._digest(normalize_username(username))[:12]
+
+    def file_id(self, file_id):
+        return 'f' + self._digest(file_id)[:24]
+
+    def mask(self, text):
+        # Длину сохраняем: от неё зависит проверка длины отзыва
+        return 'x' * len(text)
+
+    def text(self, text):
+        stripped = text.strip()
+        if stripped.lower() in CONTROL_TEXTS or CONTROL_PATTERN.match(stripped):
+            return text
+        if stripped.startswith('@') and ' ' not in stripped:
+            return '@' + self.username(stripped)
+        return self.mask(text)
+
+    def callback_data(self, data):
+        match = CALLBACK_PATTERN.match(data)
+        if match is None:
+            return data
+        return f"{match.group(1)}_{self.user_id(int(match.group(2)))}"
+
+    def update(self, data, parent=None):
+        """Обезличенная копия обновления (словаря из Update.to_dict())"""
+        if isinstance(data, list):
+            return [self.update(item, parent) for item in data]
+        if not isinstance(data, dict):
+            return data
+        user = parent in ID_PARENTS or is_user(data)
+        result = {}
+        for key, value in data.items():
+            if key in DROPPED_FIELDS:
+                continue
+            if key == 'id' and user and isinstance(value, int):
+                value = self.user_id(value)
+            elif key == 'user_id' and isinstance(value, int):
+                value = self.user_id(value)
+            elif key == 'username':
+                value = self.username(value)
+            elif key in NAME_FIELDS and isinstance(value, str):
+                value = self.mask(value)
+            elif key in ('file_id', 'file_unique_id'):
+                value = self.file_id(value)
+            elif key in ('text', 'caption') and isinstance(value, str):
+                value = self.text(value)
+            elif key == 'callback_data' or (key == 'data' and parent == 'callback_query'):
+                # Кнопки карточек несут id анкеты и в самих обновлениях,
+                # и в reply_markup сообщения, к которому привязан callback
+                value = self.callback_data(value)
+            else:
+                value = self.update(value, key)
+            result[key] = value
+        return result
+
+
+class UpdateRecorder:
+    """Обработчик TypeHandler(Update), который пишет обновления в JSONL"""
+
+    def __init__(self, path, key=''):
+        # Без ключа псевдонимы случайные: данные под запись обезличить не получится
+        self.anonymizer = Anonymizer(key or secrets.token_hex(16))
+        self.log = BufferedLog(AppendLog(path))
+        self._started = time.monotonic()
+
+    async def record(self, update, context):
+        self.log.append({
+            't': round(time.monotonic() - self._started, 3),
+            'u': self.anonymizer.update(update.to_dict()),
+        })
+
+    def start(self):
+        self._started = time.monotonic()
+        self.log.start()
+
+    async def stop(self):
+        await self.log.stop()
+        self.log.close()
+
+
+def read_recording(path):
+    """(время, обновление) из файла записи"""
+    for record in AppendLog(path).replay():
+        yield record['t'], record['u']
+
+
+def anonymize_data_dir(src, dst, anonymizer):
+    """Копирует JSON-данные бота из src в dst, заменяя личные данные
+    теми же псевдонимами, что и в записи"""
+    os.makedirs(dst, exist_ok=True)
+
+    profiles = []
+    for profile in load_json(os.path.join(src, 'users.json'), []):
+        profile = dict(profile, user_id=anonymizer.user_id(profile['user_id']))
+        if profile.get('username'):
+            profile['username'] = anonymizer.username(profile['username'])
+        if profile.get('about'):
+            profile['about'] = anonymizer.mask(profile['about'])
+        if profile.get('photo_id'):
+            profile['photo_id'] = anonymizer.file_id(profile['photo_id'])
+        profiles.append(profile)
+    atomic_write_json(os.path.join(dst, 'users.json'), profiles)
+
+    reviews = {
+        anonymizer.username(username): [anonymizer.mask(text) for text in texts]
+        for username, texts in load_json(os.path.join(src, 'reviews.json'), {}).items()
+    }
+    atomic_write_json(os.path.join(dst, 'reviews.json'), reviews)
+
+    legacy_likes = load_json(os.path.join(src, 'likes.json'), None)
+    if legacy_likes is not None:
+        atomic_write_json(os.path.join(dst, 'likes.json'), {
+            str(anonymizer.user_id(int(from_id))): [anonymizer.user_id(int(to_id)) for to_id in liked]
+            for from_id, liked in legacy_likes.items()
+        })
+
+    logs = (('likes.log', ('from', 'to')), ('seen.log', ('user', 'seen')), ('activity.log', ('user',)))
+    for name, fields in logs:
+        records = (
+            dict(record, **{field: anonymizer.user_id(record[field]) for field in fields})
+            for record in AppendLog(os.path.join(src, name)).replay()
+        )
+        with open(os.path.join(dst, name), 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
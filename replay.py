@@ -0,0 +1,148 @@
+"""Воспроизведение записанных обновлений (см. recording.py).
+
+Обновления из записи подаются в настоящее приложение (Application из
+main.py с теми же обработчиками и порядком обработки) на копии данных во
+временном каталоге. Ответы бота принимает локальная замена Bot API из
+loadtest.py, поэтому сеть не нужна.
+
+    python replay.py updates.jsonl --data-dir ./data --speed 1     # как было
+    python replay.py updates.jsonl --data-dir ./data --speed 20    # в 20 раз быстрее
+    python replay.py updates.jsonl --data-dir ./data --speed 0     # без пауз
+    python replay.py updates.jsonl --data-dir ./data --key $BOT_RECORD_KEY --storage sqlite  # из JSON
+
+С --key копия данных обезличивается тем же ключом, что и запись, чтобы
+идентификаторы в обновлениях совпали с анкетами и лайками. Обезличиваются
+только JSON-данные, поэтому каталог с bot.db с --key не принимается.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Совпадает с loadtest.TOKEN: импортировать loadtest до настройки окружения нельзя
+TOKEN = '123456:LOADTEST'
+
+
+def update_kind(data):
+    """Категория обновления для отчёта: кнопка, команда или тип сообщения"""
+    if 'callback_query' in data:
+        return 'callback:' + data['callback_query'].get('data', '').split('_')[0]
+    message = data.get('message') or {}
+    if 'photo' in message:
+        return 'message:photo'
+    text = message.get('text') or ''
+    if text.startswith('/'):
+        return 'message:' + text.split()[0]
+    return 'message:text'
+
+
+def prepare_data_dir(src, dst, key, storage_backend):
+    if key and os.path.exists(os.path.join(src, 'bot.db')):
+        # Данные, которые есть только в SQLite, молча потерялись бы
+        raise SystemExit(f"--key обезличивает только JSON-данные, а в {src} есть bot.db")
+    if key:
+        from recording import Anonymizer, anonymize_data_dir
+        anonymize_data_dir(src, dst, Anonymizer(key))
+    else:
+        shutil.copytree(src, dst, dirs_exist_ok=True)
+    if storage_backend == 'sqlite' and (key or not os.path.exists(os.path.join(dst, 'bot.db'))):
+        import migrate
+        migrate.migrate(dst, os.path.join(dst, 'bot.db'))
+
+
+async def replay(args, data_dir):
+    import loadtest
+    api = loadtest.FakeBotApi(latency=args.latency_ms / 1000)
+    await api.start(args.host, args.port)
+
+    from telegram import Update
+    import main
+    import metrics
+    from metrics import percentile
+    from recording import read_recording
+
+    main.init_storage()
+    application = main.build_application()
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    latencies = {}
+    tasks = []
+
+    async def process(update, kind, submitted):
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies.setdefault(kind, []).append((time.monotonic() - submitted) * 1000)
+
+    started = time.monotonic()
+    for offset, data in read_recording(args.recording):
+        if args.speed > 0:
+            delay = started + offset / args.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        query = data.get('callback_query')
+        if query and query.get('message'):
+            # Сообщение с карточкой должно существовать, чтобы бот мог его отредактировать
+            message = query['message']
+            api.messages[(message['chat']['id'], message['message_id'])] = message
+        update = Update.de_json(data, application.bot)
+        tasks.append(asyncio.create_task(process(update, update_kind(data), time.monotonic())))
+    await asyncio.gather(*tasks)
+    duration = time.monotonic() - started
+
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await api.stop()
+
+    print(f"\nОбновлений: {len(tasks)}, время: {duration:.2f} с, {len(tasks) / max(duration, 1e-9):.1f} в секунду")
+    print(f"{'тип':<28}{'n':>8}{'p50, мс':>12}{'p95, мс':>12}{'p99, мс':>12}")
+    for kind, values in sorted(latencies.items()):
+        values.sort()
+        print(f"{kind:<28}{len(values):>8}{percentile(values, 50):>12.1f}"
+              f"{percentile(values, 95):>12.1f}{percentile(values, 99):>12.1f}")
+    print("\nВызовы API: " + ", ".join(f"{method}={count}" for method, count in api.calls.most_common()))
+    if metrics.ENABLED:
+        print("\n" + metrics.summary())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных обновлений")
+    parser.add_argument('recording', help="файл записи (BOT_RECORD_FILE)")
+    parser.add_argument('--data-dir', required=True, help="каталог с данными бота, копируется во временный")
+    parser.add_argument('--speed', type=float, default=1.0, help="ускорение; 0 - без пауз")
+    parser.add_argument('--key', default='', help="ключ записи (BOT_RECORD_KEY) для обезличивания копии данных")
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--latency-ms', type=float, default=0, help="задержка ответа Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--keep', action='store_true', help="не удалять временный каталог с данными")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='replay-')
+    # Настройки читаются при импорте config, поэтому задаём их до импорта
+    # любых модулей бота
+    os.environ.update(
+        BOT_DATA_DIR=data_dir,
+        BOT_STORAGE=args.storage,
+        BOT_TOKEN=TOKEN,
+        BOT_API_BASE_URL=f'http://{args.host}:{args.port}/bot',
+        BOT_RECORD_FILE='',
+    )
+    try:
+        prepare_data_dir(args.data_dir, data_dir, args.key, args.storage)
+        asyncio.run(replay(args, data_dir))
+    finally:
+        if args.keep:
+            print(f"Данные после воспроизведения: {data_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
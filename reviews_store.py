@@ -0,0 +1,67 @@
+from persistence import WriteBehindStore
+
+# Сколько отзывов показывать в карточке анкеты
+SUMMARY_SIZE = 3
+
+
+def normalize_username(username):
+    return username.lstrip('@').lower()
+
+
+class ReviewsStore(WriteBehindStore):
+    """Отзывы в памяти, ключ - username без @ в нижнем регистре.
+
+    Для карточек анкет хранится готовая сводка: первые SUMMARY_SIZE
+    отзывов и количество остальных. Она обновляется при добавлении отзыва.
+    """
+
+    default = {}
+
+    def __init__(self, backend, **kwargs):
+        super().__init__(backend, **kwargs)
+        self._reviews = {}
+        self._summaries = {}
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """callback(username) вызывается после добавления отзыва"""
+        self._listeners.append(callback)
+
+    def _load(self, data):
+        self._reviews = {}
+        self._summaries = {}
+        for username, texts in data.items():
+            key = normalize_username(username)
+            self._reviews.setdefault(key, []).extend(texts)
+        for key, texts in self._reviews.items():
+            self._summaries[key] = (tuple(texts[:SUMMARY_SIZE]), max(len(texts) - SUMMARY_SIZE, 0))
+
+    def _snapshot(self):
+        # Списки отзывов только дополняются, поэтому копируем их для записи в потоке
+        return {key: list(texts) for key, texts in self._reviews.items()}
+
+    def _items(self, keys):
+        return {key: list(self._reviews.get(key, [])) for key in keys}
+
+    def get(self, username):
+        return self._reviews.get(normalize_username(username), [])
+
+    def count(self, username):
+        return len(self._reviews.get(normalize_username(username), ()))
+
+    def summary(self, username):
+        """(первые отзывы, сколько ещё) для карточки анкеты"""
+        return self._summaries.get(normalize_username(username), ((), 0))
+
+    def add(self, username, text):
+        key = normalize_username(username)
+        self._reviews.setdefault(key, []).append(text)
+        top, more = self._summaries.get(key, ((), 0))
+        if len(top) < SUMMARY_SIZE:
+            top = top + (text,)
+        else:
+            more += 1
+        self._summaries[key] = (top, more)
+        self.mark_dirty(key)
+        for callback in self._listeners:
+            callback(key)
@@ -0,0 +1,52 @@
+from persistence import AppendLog
+
+
+class SeenStore:
+    """Анкеты, которые пользователь уже пропустил.
+
+    Для каждого пользователя хранится не больше limit последних user_id
+    (словарь используется как упорядоченное множество, старые вытесняются).
+    На диск пишется журнал, при загрузке он сжимается, если сильно разросся.
+    log - путь к файлу журнала или объект с интерфейсом AppendLog.
+    """
+
+    def __init__(self, log, limit=5000):
+        self.log = AppendLog(log) if isinstance(log, str) else log
+        self.limit = limit
+        self._seen = {}
+        self._records = 0
+
+    def load(self):
+        self._seen = {}
+        self._records = 0
+        for record in self.log.replay():
+            self._add(record['user'], record['seen'])
+            self._records += 1
+        total = sum(len(seen) for seen in self._seen.values())
+        if self._records > 2 * total:
+            self.log.rewrite(
+                {'user': user_id, 'seen': seen_id}
+                for user_id, seen in self._seen.items()
+                for seen_id in seen
+            )
+            self._records = total
+
+    def _add(self, user_id, seen_id):
+        seen = self._seen.setdefault(user_id, {})
+        if seen_id in seen:
+            return False
+        seen[seen_id] = None
+        if len(seen) > self.limit:
+            del seen[next(iter(seen))]
+        return True
+
+    def mark(self, user_id, seen_id):
+        if self._add(user_id, seen_id):
+            self.log.append({'user': user_id, 'seen': seen_id})
+            self._records += 1
+
+    def seen_by(self, user_id):
+        return self._seen.get(user_id, {})
+
+    def close(self):
+        self.log.close()
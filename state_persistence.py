@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from persistence import run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+class SqlitePersistence(BasePersistence):
+    """Хранение user_data и состояний ConversationHandler в SQLite.
+
+    Application сам раз в update_interval секунд передаёт сюда изменения
+    пользователей и диалогов. Все изменения одного такого прохода
+    записываются одной транзакцией. В user_data лежат только поля анкеты
+    и курсор поиска, поэтому после перезапуска диалоги продолжаются сразу.
+    """
+
+    def __init__(self, storage, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.storage = storage
+        self._pending_users = {}
+        self._pending_conversations = {}
+        self._batch = None
+        self._write_lock = asyncio.Lock()
+
+    # --- Загрузка ---
+
+    async def get_user_data(self):
+        return await run_blocking(self.storage.load_user_state)
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return await run_blocking(self.storage.load_conversations, name)
+
+    # --- Изменения ---
+
+    async def update_user_data(self, user_id, data):
+        # Сериализуем сразу: user_data продолжает меняться, пока идёт запись
+        self._pending_users[user_id] = json.dumps(data, ensure_ascii=False)
+        await self._write_batch()
+
+    async def drop_user_data(self, user_id):
+        self._pending_users[user_id] = None
+        await self._write_batch()
+
+    async def update_conversation(self, name, key, new_state):
+        state = None if new_state is None else json.dumps(new_state)
+        self._pending_conversations[(name, json.dumps(key))] = state
+        await self._write_batch()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._pending_users or self._pending_conversations:
+            await self._write_batch()
+
+    # --- Запись ---
+
+    async def _write_batch(self):
+        # Application вызывает update_* для всех изменившихся пользователей
+        # одновременно: они дожидаются одной общей записи
+        if self._batch is None:
+            self._batch = asyncio.ensure_future(self._write_pending())
+        await asyncio.shield(self._batch)
+
+    async def _write_pending(self):
+        await asyncio.sleep(0)
+        self._batch = None
+        users, self._pending_users = self._pending_users, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        # Записи идут строго по очереди, чтобы старое состояние не перезаписало новое
+        async with self._write_lock:
+            try:
+                await run_blocking(self.storage.save_state, users, conversations)
+            except Exception:
+                logger.exception("Не удалось сохранить состояние диалогов")
+                for user_id, data in users.items():
+                    self._pending_users.setdefault(user_id, data)
+                for key, state in conversations.items():
+                    self._pending_conversations.setdefault(key, state)
+                raise
@@ -0,0 +1,333 @@
+import json
+import sys
+from array import array
+from functools import partial
+
+import database
+from profile_store import PROFILE_FIELDS
+
+# Единая схема для анкет, лайков, отзывов и просмотренных анкет
+TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS profiles (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        gender TEXT,
+        age INTEGER,
+        about TEXT,
+        target_gender TEXT,
+        age_min INTEGER,
+        age_max INTEGER,
+        photo_id TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS likes (
+        from_user_id INTEGER NOT NULL,
+        to_user_id INTEGER NOT NULL,
+        PRIMARY KEY (from_user_id, to_user_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS reviews (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        target_username TEXT NOT NULL,
+        text TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS seen (
+        user_id INTEGER NOT NULL,
+        seen_user_id INTEGER NOT NULL,
+        UNIQUE (user_id, seen_user_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS activity (
+        user_id INTEGER PRIMARY KEY,
+        last_active INTEGER NOT NULL
+    )
+    ''',
+    # Очереди кандидатов от precompute.py: параметры поиска (JSON), для
+    # которых очередь построена, и user_id кандидатов от лучшего к худшему
+    # (int64 little-endian, см. unpack_ids)
+    '''
+    CREATE TABLE IF NOT EXISTS recommendations (
+        user_id INTEGER PRIMARY KEY,
+        params TEXT NOT NULL,
+        candidates BLOB NOT NULL,
+        built_at INTEGER NOT NULL
+    )
+    ''',
+    # user_data и состояния ConversationHandler (значения в JSON)
+    '''
+    CREATE TABLE IF NOT EXISTS user_state (
+        user_id INTEGER PRIMARY KEY,
+        data TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS conversations (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (name, key)
+    ) WITHOUT ROWID
+    ''',
+)
+
+# Поиск, лайки и чтение анкет идут через хранилища в памяти, а таблицы
+# только хранят их данные; индекс нужен для перезаписи отзывов пользователя
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_reviews_target ON reviews (target_username)',
+)
+
+PROFILE_COLUMNS = ('user_id',) + PROFILE_FIELDS
+
+
+def unpack_ids(data):
+    """Список user_id из байтов: int64 little-endian подряд"""
+    ids = array('q')
+    ids.frombytes(data)
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids.tolist()
+
+
+class Storage:
+    """Хранилище анкет, лайков и отзывов в SQLite (таблицы в bot.db)"""
+
+    def __init__(self, db_file=database.DB_FILE):
+        self.manager = database.get_manager(db_file)
+
+    def connection(self):
+        return self.manager.connection()
+
+    def create_schema(self, indexes=True):
+        conn = self.connection()
+        with conn:
+            for sql in TABLES:
+                conn.execute(sql)
+        if indexes:
+            self.create_indexes()
+
+    def create_indexes(self):
+        conn = self.connection()
+        with conn:
+            for sql in INDEXES:
+                conn.execute(sql)
+
+    # --- Анкеты ---
+
+    def load_profiles(self):
+        return list(self.iter_profiles())
+
+    def iter_profiles(self):
+        """Анкеты по одной, без загрузки всей таблицы в память"""
+        conn = self.connection()
+        cursor = conn.execute(f"SELECT {', '.join(PROFILE_COLUMNS)} FROM profiles ORDER BY rowid")
+        for row in cursor:
+            yield {column: value for column, value in zip(PROFILE_COLUMNS, row) if value is not None}
+
+    def upsert_profiles(self, profiles):
+        columns = ', '.join(PROFILE_COLUMNS)
+        placeholders = ', '.join('?' for _ in PROFILE_COLUMNS)
+        updates = ', '.join(f"{column} = excluded.{column}" for column in PROFILE_FIELDS)
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                f"INSERT INTO profiles ({columns}) VALUES ({placeholders}) "
+                f"ON CONFLICT(user_id) DO UPDATE SET {updates}",
+                [tuple(profile.get(column) for column in PROFILE_COLUMNS) for profile in profiles]
+            )
+
+    # --- Отзывы ---
+
+    def load_reviews(self):
+        reviews = {}
+        for username, text in self.connection().execute("SELECT target_username, text FROM reviews ORDER BY id"):
+            reviews.setdefault(username, []).append(text)
+        return reviews
+
+    def count_reviews(self):
+        """Пары (username, число отзывов) без чтения текстов"""
+        return self.connection().execute(
+            "SELECT target_username, COUNT(*) FROM reviews GROUP BY target_username"
+        )
+
+    def replace_reviews(self, reviews_by_username):
+        """Перезаписывает отзывы указанных пользователей"""
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                "DELETE FROM reviews WHERE target_username = ?",
+                [(username,) for username in reviews_by_username]
+            )
+            conn.executemany(
+                "INSERT INTO reviews (target_username, text) VALUES (?, ?)",
+                [
+                    (username, text)
+                    for username, texts in reviews_by_username.items()
+                    for text in texts
+                ]
+            )
+
+    # --- Готовые очереди поиска ---
+
+    def get_recommendations(self, user_id):
+        """(параметры поиска, список user_id, время построения) или None"""
+        row = self.connection().execute(
+            "SELECT params, candidates, built_at FROM recommendations WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        params, candidates, built_at = row
+        return json.loads(params), unpack_ids(candidates), built_at
+
+    def save_recommendations(self, rows):
+        """rows - кортежи (user_id, параметры, user_id кандидатов в формате
+        unpack_ids, время построения)"""
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO recommendations (user_id, params, candidates, built_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (user_id, json.dumps(params, ensure_ascii=False), candidates, built_at)
+                    for user_id, params, candidates, built_at in rows
+                ]
+            )
+
+    def delete_recommendations_before(self, built_at):
+        """Удаляет очереди прошлых построений (например, у удалённых анкет)"""
+        conn = self.connection()
+        with conn:
+            conn.execute("DELETE FROM recommendations WHERE built_at < ?", (built_at,))
+
+    # --- Состояние диалогов ---
+
+    def load_user_state(self):
+        cursor = self.connection().execute("SELECT user_id, data FROM user_state")
+        return {user_id: json.loads(data) for user_id, data in cursor}
+
+    def load_conversations(self, name):
+        cursor = self.connection().execute("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in cursor}
+
+    def save_state(self, users, conversations):
+        """Записывает user_data ({user_id: JSON}) и состояния диалогов
+        ({(name, key JSON): state JSON}) одной транзакцией. None - удалить запись"""
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                "DELETE FROM user_state WHERE user_id = ?",
+                [(user_id,) for user_id, data in users.items() if data is None]
+            )
+            conn.executemany(
+                "INSERT INTO user_state (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                [(user_id, data) for user_id, data in users.items() if data is not None]
+            )
+            conn.executemany(
+                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                [key for key, state in conversations.items() if state is None]
+            )
+            conn.executemany(
+                "INSERT INTO conversations (name, key, state) VALUES (?, ?, ?) "
+                "ON CONFLICT(name, key) DO UPDATE SET state = excluded.state",
+                [(*key, state) for key, state in conversations.items() if state is not None]
+            )
+
+
+class SqliteProfilesBackend:
+    """Хранение ProfileStore в таблице profiles: пишутся только изменённые анкеты"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __repr__(self):
+        return 'profiles'
+
+    def load(self):
+        return self.storage.load_profiles()
+
+    def prepare(self, store, dirty):
+        profiles = [profile for profile in store._items(dirty).values() if profile is not None]
+        return partial(self.storage.upsert_profiles, profiles)
+
+
+class SqliteReviewsBackend:
+    """Хранение ReviewsStore в таблице reviews: пишутся только изменённые пользователи"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __repr__(self):
+        return 'reviews'
+
+    def load(self):
+        return self.storage.load_reviews()
+
+    def prepare(self, store, dirty):
+        return partial(self.storage.replace_reviews, store._items(dirty))
+
+
+class SqliteLog:
+    """Таблица (a, b) с интерфейсом AppendLog для LikesGraph, SeenStore
+    и ActivityStore. on_conflict - что делать с повторным ключом"""
+
+    def __init__(self, storage, table, columns, fields, order_by=None, on_conflict='IGNORE'):
+        self.storage = storage
+        self.table = table
+        self.columns = columns
+        self.fields = fields
+        self.order_by = order_by
+        self.on_conflict = on_conflict
+
+    def exists(self):
+        return True
+
+    def replay(self):
+        sql = f"SELECT {', '.join(self.columns)} FROM {self.table}"
+        if self.order_by:
+            sql += f" ORDER BY {self.order_by}"
+        cursor = self.storage.connection().execute(sql)
+        for row in cursor:
+            yield dict(zip(self.fields, row))
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        conn = self.storage.connection()
+        with conn:
+            conn.executemany(
+                f"INSERT OR {self.on_conflict} INTO {self.table} ({', '.join(self.columns)}) VALUES (?, ?)",
+                [tuple(record[field] for field in self.fields) for record in records]
+            )
+
+    def rewrite(self, records):
+        conn = self.storage.connection()
+        with conn:
+            conn.execute(f"DELETE FROM {self.table}")
+            conn.executemany(
+                f"INSERT OR {self.on_conflict} INTO {self.table} ({', '.join(self.columns)}) VALUES (?, ?)",
+                [tuple(record[field] for field in self.fields) for record in records]
+            )
+
+    def close(self):
+        pass
+
+
+def likes_log(storage):
+    return SqliteLog(storage, 'likes', ('from_user_id', 'to_user_id'), ('from', 'to'))
+
+
+def seen_log(storage):
+    # Порядок вставки нужен SeenStore, чтобы вытеснять самые старые записи
+    return SqliteLog(storage, 'seen', ('user_id', 'seen_user_id'), ('user', 'seen'), order_by='rowid')
+
+
+def activity_log(storage):
+    # На пользователя одна строка с последним временем активности
+    return SqliteLog(storage, 'activity', ('user_id', 'last_active'), ('user', 't'), on_conflict='REPLACE')
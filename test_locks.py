@@ -0,0 +1,94 @@
+import asyncio
+import inspect
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram import Chat, Message, Update, User
+
+from locks import PerUserUpdateProcessor
+
+_update_ids = iter(range(1, 1_000_000))
+
+
+def make_update(user_id):
+    update_id = next(_update_ids)
+    return Update(update_id, message=Message(
+        update_id, datetime.now(), Chat(user_id, Chat.PRIVATE), from_user=User(user_id, 'user', False),
+    ))
+
+
+def test_updates_of_one_user_keep_order():
+    log = []
+
+    async def handler(name, delay):
+        log.append(('start', name))
+        await asyncio.sleep(delay)
+        log.append(('end', name))
+
+    async def main():
+        processor = PerUserUpdateProcessor(4)
+        # Первое обновление самое долгое: без очереди второе и третье закончились бы раньше
+        await asyncio.gather(*(
+            processor.process_update(make_update(1), handler(name, delay))
+            for name, delay in (('a1', 0.05), ('a2', 0.01), ('a3', 0))
+        ))
+
+    asyncio.run(main())
+    assert log == [('start', 'a1'), ('end', 'a1'), ('start', 'a2'), ('end', 'a2'), ('start', 'a3'), ('end', 'a3')]
+
+
+def test_queued_updates_do_not_hold_slots():
+    async def main():
+        processor = PerUserUpdateProcessor(2)
+        release = asyncio.Event()
+
+        async def blocked():
+            await release.wait()
+
+        async def quick():
+            pass
+
+        burst = [asyncio.create_task(processor.process_update(make_update(1), blocked())) for _ in range(5)]
+        await asyncio.sleep(0)
+        # Первое обновление пользователя 1 занимает одно место, остальные
+        # ждут его без места, поэтому пользователь 2 не ждёт
+        await asyncio.wait_for(processor.process_update(make_update(2), quick()), timeout=1)
+        release.set()
+        await asyncio.gather(*burst)
+
+    asyncio.run(main())
+
+
+def test_cancelled_queued_update():
+    log = []
+
+    async def handler(name, event=None):
+        log.append(('start', name))
+        if event is not None:
+            await event.wait()
+        log.append(('end', name))
+
+    async def main():
+        processor = PerUserUpdateProcessor(4)
+        release = asyncio.Event()
+        cancelled = handler('a2')
+        first = asyncio.create_task(processor.process_update(make_update(1), handler('a1', release)))
+        second = asyncio.create_task(processor.process_update(make_update(1), cancelled))
+        third = asyncio.create_task(processor.process_update(make_update(1), handler('a3')))
+        await asyncio.sleep(0)
+        second.cancel()
+        await asyncio.sleep(0)
+        # Третье обновление по-прежнему ждёт первое, хотя второе отменено
+        assert log == [('start', 'a1')]
+        release.set()
+        results = await asyncio.gather(first, second, third, return_exceptions=True)
+        assert results[0] is None and results[2] is None
+        assert isinstance(results[1], asyncio.CancelledError)
+        assert inspect.getcoroutinestate(cancelled) == inspect.CORO_CLOSED
+        assert not processor._tails
+
+    asyncio.run(main())
+    assert log == [('start', 'a1'), ('end', 'a1'), ('start', 'a3'), ('end', 'a3')]
@@ -0,0 +1,75 @@
+import os
+import random
+import tempfile
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+# database (через precompute) открывает bot.db в BOT_DATA_DIR при импорте
+os.environ.setdefault('BOT_DATA_DIR', tempfile.mkdtemp(prefix='test-precompute-'))
+
+from matching import MatchIndex, search_params
+from precompute import Columns, Rated, build
+from ranking import Ranker
+from storage import unpack_ids
+
+NOW = 1_000_000
+
+
+def pairs(rated):
+    return ((user_id, other) for user_id, others in rated.items() for other in others)
+
+
+def make_profiles(count, seed):
+    # Мало различных значений, чтобы у многих кандидатов оценки совпадали
+    rng = random.Random(seed)
+    profiles = []
+    for user_id in range(1, count + 1):
+        age_min = rng.choice((18, 20, 25))
+        profiles.append({
+            'user_id': user_id,
+            'gender': rng.choice(('Мужской', 'Женский')),
+            'age': rng.choice((20, 25, 30)),
+            'target_gender': rng.choice(('Мужской', 'Женский', 'Любой', 'любой')),
+            'age_min': age_min,
+            'age_max': age_min + rng.choice((5, 15)),
+            'photo_id': rng.choice(('photo', None)),
+            'username': f'user{user_id}',
+        })
+    return profiles
+
+
+@pytest.mark.parametrize('two_sided', (True, False))
+def test_build_matches_ranker_top_with_ties(two_sided):
+    profiles = make_profiles(300, seed=1)
+    reviews = {f'user{user_id}': user_id % 3 for user_id in range(1, 301)}
+    last_active = {user_id: NOW - 3600 * (user_id % 2) for user_id in range(1, 301, 3)}
+    rng = random.Random(2)
+    rated = {user_id: set(rng.sample(range(1, 301), 10)) for user_id in range(1, 301, 2)}
+    size = 7
+
+    def review_count(profile):
+        return reviews[profile['username']]
+
+    ranker = Ranker()
+    columns = Columns(profiles, review_count, last_active)
+    built = {
+        user_id: (params, unpack_ids(candidates))
+        for chunk in build(columns, ranker, Rated(pairs(rated)), size, two_sided, chunk_size=50, now=NOW)
+        for user_id, params, candidates in chunk
+    }
+
+    index = MatchIndex()
+    index.rebuild(profiles)
+    by_id = {profile['user_id']: profile for profile in profiles}
+    for profile in profiles:
+        skip = rated.get(profile['user_id'], set())
+        candidates = (
+            by_id[candidate_id]
+            for _, candidate_ids in index.iter_match_by_age(profile, two_sided)
+            for candidate_id in candidate_ids
+            if candidate_id not in skip
+        )
+        expected = ranker.top(profile, candidates, size, review_count, last_active.get, now=NOW)
+        assert built[profile['user_id']] == (search_params(profile), expected)
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+from matching import MatchIndex
+from ranking import Ranker
+
+NOW = 1_000_000
+
+
+def make_profiles(count, seed):
+    rng = random.Random(seed)
+    profiles = []
+    for user_id in range(1, count + 1):
+        age_min = rng.randint(18, 40)
+        profiles.append({
+            'user_id': user_id,
+            'gender': rng.choice(('Мужской', 'Женский')),
+            'age': rng.randint(18, 60),
+            'target_gender': rng.choice(('Мужской', 'Женский', 'Любой')),
+            'age_min': age_min,
+            'age_max': age_min + rng.randint(0, 20),
+            'photo_id': rng.choice(('photo', None)),
+            'username': f'user{user_id}',
+        })
+    return profiles
+
+
+@pytest.mark.parametrize('recency_weight', (1.0, 0.0))
+def test_top_by_age_matches_top(recency_weight):
+    profiles = make_profiles(2000, seed=3)
+    by_id = {profile['user_id']: profile for profile in profiles}
+    last_active = {user_id: NOW - 3600 * (user_id % 50) for user_id in range(1, 2001, 4)}
+
+    def review_count(profile):
+        return profile['user_id'] % 4
+
+    ranker = Ranker(recency_weight=recency_weight)
+    index = MatchIndex()
+    index.rebuild(profiles)
+    for profile in profiles[:200]:
+        groups = [
+            (age, [by_id[candidate_id] for candidate_id in candidate_ids])
+            for age, candidate_ids in index.iter_match_by_age(profile)
+        ]
+        candidates = [candidate for _, group in groups for candidate in group]
+        expected = ranker.top(profile, candidates, 10, review_count, last_active.get, now=NOW)
+        assert ranker.top_by_age(profile, groups, 10, review_count, last_active.get, now=NOW) == expected
+
+
+def test_top_by_age_limit_scores_nearest_ages_first():
+    profiles = make_profiles(2000, seed=4)
+    by_id = {profile['user_id']: profile for profile in profiles}
+    index = MatchIndex()
+    index.rebuild(profiles)
+    searcher = dict(profiles[0], target_gender='Любой', age_min=20, age_max=40)
+    scored = []
+
+    def review_count(profile):
+        scored.append(profile['age'])
+        return 0
+
+    groups = (
+        (age, (by_id[candidate_id] for candidate_id in candidate_ids))
+        for age, candidate_ids in index.iter_match_by_age(searcher, two_sided=False)
+    )
+    top = Ranker().top_by_age(searcher, groups, 10, review_count, lambda user_id: None, limit=50, now=NOW)
+    assert len(scored) == 50 and len(top) == 10
+    distances = [abs(age - 30) for age in scored]
+    assert distances == sorted(distances)
@@ -0,0 +1,76 @@
+from recording import Anonymizer
+
+KEY = 'test-key'
+USER_ID = 1001
+FORWARDED_ID = 2002
+CARD_ID = 3003
+
+
+def user(user_id, first_name):
+    return {'id': user_id, 'is_bot': False, 'first_name': first_name, 'username': f'name{user_id}'}
+
+
+def card_markup(user_id):
+    return {'inline_keyboard': [[
+        {'text': 'Лайк', 'callback_data': f'like_{user_id}'},
+        {'text': 'Пропустить', 'callback_data': f'skip_{user_id}'},
+    ]]}
+
+
+def test_forwarded_message():
+    anonymizer = Anonymizer(KEY)
+    update = {'update_id': 1, 'message': {
+        'message_id': 10, 'date': 0,
+        'from': user(USER_ID, 'Иван'),
+        'chat': {'id': USER_ID, 'type': 'private', 'first_name': 'Иван'},
+        'forward_origin': {'type': 'user', 'date': 0, 'sender_user': user(FORWARDED_ID, 'Пётр')},
+        'forward_from': user(FORWARDED_ID, 'Пётр'),
+        'text': 'Привет',
+    }}
+    message = anonymizer.update(update)['message']
+
+    forwarded = anonymizer.user_id(FORWARDED_ID)
+    assert message['forward_origin']['sender_user']['id'] == forwarded
+    assert message['forward_from']['id'] == forwarded
+    assert message['forward_from']['first_name'] == 'xxxx'
+    assert message['from']['id'] == message['chat']['id'] == anonymizer.user_id(USER_ID)
+    assert message['message_id'] == 10
+
+
+def test_hidden_forward_name():
+    anonymizer = Anonymizer(KEY)
+    update = {'update_id': 2, 'message': {
+        'message_id': 11, 'date': 0,
+        'from': user(USER_ID, 'Иван'),
+        'chat': {'id': USER_ID, 'type': 'private'},
+        'forward_origin': {'type': 'hidden_user', 'date': 0, 'sender_user_name': 'Пётр Петров'},
+        'text': 'Привет',
+    }}
+    origin = anonymizer.update(update)['message']['forward_origin']
+    assert origin['sender_user_name'] == 'x' * len('Пётр Петров')
+
+
+def test_callback_with_card():
+    anonymizer = Anonymizer(KEY)
+    update = {'update_id': 3, 'callback_query': {
+        'id': '77', 'chat_instance': '1',
+        'from': user(USER_ID, 'Иван'),
+        'data': f'like_{CARD_ID}',
+        'message': {
+            'message_id': 12, 'date': 0,
+            'from': {'id': 123456, 'is_bot': True, 'first_name': 'Бот'},
+            'chat': {'id': USER_ID, 'type': 'private'},
+            'photo': [{'file_id': 'photo', 'file_unique_id': 'unique', 'width': 1, 'height': 1}],
+            'caption': 'Анна, 25',
+            'reply_markup': card_markup(CARD_ID),
+        },
+    }}
+    query = anonymizer.update(update)['callback_query']
+
+    card = anonymizer.user_id(CARD_ID)
+    assert query['id'] == '77'
+    assert query['data'] == f'like_{card}'
+    buttons = query['message']['reply_markup']['inline_keyboard'][0]
+    assert [button['callback_data'] for button in buttons] == [f'like_{card}', f'skip_{card}']
+    assert str(CARD_ID) not in repr(query)
+    assert query['message']['photo'][0]['file_id'] == anonymizer.file_id('photo')
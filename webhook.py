@@ -0,0 +1,163 @@
+"""Приём обновлений через webhook вместо long polling.
+
+Небольшой HTTP-сервер на asyncio: принимает POST с JSON обновления,
+проверяет путь и секретный токен, кладёт обновление в
+application.update_queue и сразу отвечает 200. Обработка идёт дальше
+обычным порядком, Telegram не ждёт ответа обработчиков.
+
+Проверить локально можно, отправив записанное обновление:
+
+    curl -X POST http://127.0.0.1:8443/telegram \
+        -H 'X-Telegram-Bot-Api-Secret-Token: <секрет>' \
+        -H 'Content-Type: application/json' -d @update.json
+"""
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+MAX_BODY_SIZE = 1 << 20
+
+RESPONSES = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+}
+
+
+async def read_request(reader, max_body_size=MAX_BODY_SIZE):
+    """Читает один HTTP-запрос: (метод, путь, заголовки, тело) или None,
+    если соединение закрыто. Слишком большое тело возвращается как None"""
+    line = await reader.readline()
+    if not line:
+        return None
+    method, target, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > max_body_size:
+        return method, target, {'connection': 'close'}, None
+    body = await reader.readexactly(length) if length else b''
+    return method, target, headers, body
+
+
+class WebhookServer:
+    """HTTP-сервер, который передаёт обновления в очередь приложения"""
+
+    def __init__(self, application, listen, port, path, secret_token=''):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = '/' + path.lstrip('/')
+        self.secret_token = secret_token
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        logger.info(f"Webhook слушает http://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            # Telegram держит соединение открытым и шлёт обновления по нему подряд
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status = self._handle_request(method, target, headers, body)
+                await self._respond(writer, status)
+                if status == 413 or headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def _handle_request(self, method, target, headers, body):
+        if target.split('?', 1)[0] != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        if body is None:
+            return 413
+        if self.secret_token and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, '').encode(), self.secret_token.encode()
+        ):
+            return 403
+        try:
+            data = json.loads(body)
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Некорректное обновление в webhook: {e}")
+            return 400
+        self.application.update_queue.put_nowait(update)
+        return 200
+
+    async def _respond(self, writer, status):
+        writer.write(
+            f"HTTP/1.1 {status} {RESPONSES[status]}\r\n"
+            f"Content-Length: 0\r\n\r\n".encode('latin-1')
+        )
+        await writer.drain()
+
+
+async def run_webhook(application, listen, port, path, secret_token='',
+                      webhook_url='', allowed_updates=None, max_connections=40):
+    """Запускает приложение в режиме webhook до SIGINT/SIGTERM.
+
+    Если задан webhook_url, адрес регистрируется в Telegram через
+    setWebhook. Без него сервер просто принимает обновления (например,
+    за балансировщиком, где webhook уже настроен, или при локальной проверке).
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    server = WebhookServer(application, listen, port, path, secret_token)
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=webhook_url.rstrip('/') + server.path,
+                secret_token=secret_token or None,
+                allowed_updates=allowed_updates,
+                max_connections=max_connections,
+            )
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)